@@ -0,0 +1,219 @@
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+
+from app import app
+from models import db, User, Referral, AbuseFlag
+from archive import all_withdrawals
+
+# ======================
+# CONFIG
+# ======================
+CHUNK_SIZE = 50000
+BURST_WINDOW = 3600        # seconds
+FLAG_THRESHOLD = 0.5
+# bigger clusters are ordinary referral trees joined by a popular account,
+# not a ring
+RING_MAX_SIZE = 200
+
+# feature -> (weight, value at which it counts fully)
+WEIGHTS = {
+    "shared_account": (0.35, 3),   # other users paid out to the same account
+    "referral_burst": (0.25, 5),   # referrals by one referrer within an hour
+    "ring_size": (0.25, 5),        # users in a referral/account cluster
+    "shared_ip": (0.15, 3),        # other referred users with the same IP
+}
+
+# ======================
+# LOADING (CHUNKED, COLUMNAR)
+# ======================
+# Rows are streamed from the database CHUNK_SIZE at a time and appended
+# column by column, so only the final arrays are ever fully in memory.
+def load_columns(stmt, converters):
+    columns = [[] for _ in converters]
+
+    result = db.session.execute(stmt.execution_options(yield_per=CHUNK_SIZE))
+    for chunk in result.partitions():
+        for i, values in enumerate(zip(*chunk)):
+            columns[i].append(converters[i](values))
+
+    return [
+        np.concatenate(parts) if parts else converters[i](())
+        for i, parts in enumerate(columns)
+    ]
+
+def as_str(values):
+    return np.array([v or "" for v in values], dtype=str)
+
+def as_seconds(values):
+    ts = np.array(values, dtype="datetime64[s]")
+    return np.where(np.isnat(ts), 0, ts.astype(np.int64))
+
+def normalize(values):
+    # "0917-123 4567" and "09171234567" are the same GCash account
+    return np.char.lower(np.char.replace(np.char.replace(
+        np.char.strip(as_str(values)), " ", ""), "-", ""))
+
+# ======================
+# VECTOR HELPERS
+# ======================
+def index_of(sorted_keys, order, values):
+    # positions of `values` in the original key array, -1 when missing
+    if len(sorted_keys) == 0:
+        return np.full(len(values), -1)
+
+    pos = np.clip(np.searchsorted(sorted_keys, values), 0, len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == values, order[pos], -1)
+
+def components(n_nodes, a, b):
+    # connected components by min-label propagation with pointer jumping
+    labels = np.arange(n_nodes)
+    if len(a) == 0:
+        return labels
+
+    while True:
+        m = np.minimum(labels[a], labels[b])
+        new = labels.copy()
+        np.minimum.at(new, a, m)
+        np.minimum.at(new, b, m)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+def shared_counts(n, owner, key):
+    # for each of n owners: most other owners sharing any one of its keys,
+    # plus the number of distinct owners per key
+    key_u, owner_u = np.unique(np.stack([key, owner]), axis=1)
+    per_key = np.bincount(key_u, minlength=key.max() + 1 if len(key) else 0)
+
+    out = np.zeros(n)
+    np.maximum.at(out, owner_u, per_key[key_u] - 1)
+    return out, per_key
+
+# ======================
+# FEATURES & SCORING
+# ======================
+def score_users():
+    (user_ids,) = load_columns(
+        select(User.user_id).order_by(User.id),
+        [as_str]
+    )
+    n = len(user_ids)
+    order = np.argsort(user_ids)
+    sorted_ids = user_ids[order]
+
+    referrer, referred, signup_ip, ref_time = load_columns(
+        select(
+            Referral.referrer_id,
+            Referral.referred_id,
+            Referral.signup_ip,
+            Referral.created_at
+        ),
+        [as_str, as_str, as_str, as_seconds]
+    )
+    history = all_withdrawals()
+    w_user, w_account = load_columns(
+        select(history.c.user_id, history.c.account_info),
+        [as_str, normalize]
+    )
+
+    ref_idx = index_of(sorted_ids, order, referrer)
+    new_idx = index_of(sorted_ids, order, referred)
+    keep = (ref_idx >= 0) & (new_idx >= 0)
+    ref_idx, new_idx = ref_idx[keep], new_idx[keep]
+    signup_ip, ref_time = signup_ip[keep], ref_time[keep]
+
+    w_idx = index_of(sorted_ids, order, w_user)
+    keep = (w_idx >= 0) & (w_account != "")
+    w_idx, w_account = w_idx[keep], w_account[keep]
+
+    features = {name: np.zeros(n) for name in WEIGHTS}
+
+    # ---------- shared payout accounts ----------
+    accounts, acct_idx = np.unique(w_account, return_inverse=True)
+    users_per_acct = np.zeros(len(accounts), dtype=np.int64)
+    if len(w_idx):
+        features["shared_account"], users_per_acct = shared_counts(
+            n, w_idx, acct_idx
+        )
+
+    # ---------- referral bursts ----------
+    if len(ref_idx):
+        by_ref = np.lexsort((ref_time, ref_idx))
+        r, t = ref_idx[by_ref], ref_time[by_ref]
+        key = (r.astype(np.int64) << 32) + t
+        start = np.searchsorted(key, key - BURST_WINDOW, side="left")
+        in_window = np.arange(len(key)) - start + 1
+        np.maximum.at(features["referral_burst"], r, in_window)
+
+    # ---------- shared signup IPs ----------
+    has_ip = signup_ip != ""
+    if has_ip.any():
+        _, ip_idx = np.unique(signup_ip[has_ip], return_inverse=True)
+        features["shared_ip"], _ = shared_counts(n, new_idx[has_ip], ip_idx)
+
+    # ---------- referral / account rings ----------
+    # nodes: users [0, n) then accounts [n, n + len(accounts))
+    a = np.concatenate([ref_idx, w_idx])
+    b = np.concatenate([new_idx, n + acct_idx])
+    labels = components(n + len(accounts), a, b)
+
+    user_labels = labels[:n]
+    size = np.bincount(user_labels, minlength=n + len(accounts))
+    has_shared_acct = np.zeros(n + len(accounts), dtype=bool)
+    shared_acct_nodes = n + np.nonzero(users_per_acct > 1)[0]
+    has_shared_acct[labels[shared_acct_nodes]] = True
+    features["ring_size"] = np.where(
+        has_shared_acct[user_labels]
+        & (size[user_labels] > 2)
+        & (size[user_labels] <= RING_MAX_SIZE),
+        size[user_labels],
+        0
+    )
+
+    # ---------- score ----------
+    score = np.zeros(n)
+    for name, (weight, full) in WEIGHTS.items():
+        score += weight * np.minimum(features[name] / full, 1.0)
+
+    return user_ids, score, features
+
+def run_scan():
+    started = time.monotonic()
+    user_ids, score, features = score_users()
+
+    flagged = np.nonzero(score >= FLAG_THRESHOLD)[0]
+    now = datetime.utcnow()
+
+    rows = []
+    for i in flagged:
+        reasons = [
+            f"{name}={int(features[name][i])}"
+            for name, (_, full) in WEIGHTS.items()
+            if features[name][i] >= full / 2
+        ]
+        rows.append({
+            "user_id": str(user_ids[i]),
+            "score": round(float(score[i]), 3),
+            "reasons": ", ".join(reasons)[:200],
+            "scanned_at": now
+        })
+
+    # replace the previous scan's flags in one transaction
+    db.session.execute(delete(AbuseFlag))
+    for i in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(insert(AbuseFlag), rows[i:i + CHUNK_SIZE])
+    db.session.commit()
+
+    return len(user_ids), len(rows), time.monotonic() - started
+
+
+# Run from cron (e.g. nightly). Flags show up in /admin/withdrawals.
+if __name__ == "__main__":
+    with app.app_context():
+        scanned, flagged, elapsed = run_scan()
+
+    print(f"[OK] Scanned {scanned} users, flagged {flagged} in {elapsed:.1f}s")
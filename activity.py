@@ -0,0 +1,155 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from models import db, ActivityEvent, ActivityRollup, RollupState
+
+CHUNK_SIZE = 5000
+# events newer than this are left for the next run, so rows from
+# transactions still in flight (lower ids committed later) are not skipped
+SETTLE_SECONDS = 60
+
+GRANULARITIES = ("hour", "day")
+
+# ======================
+# RECORDING (WEB SIDE)
+# ======================
+# Only adds to the session, so the event is written by the route's own
+# commit with no extra round trip.
+def record_activity(kind, user_id=None, amount=0):
+    db.session.add(ActivityEvent(kind=kind, user_id=user_id, amount=amount))
+
+# ======================
+# ROLLUP JOB
+# ======================
+def bucket_start(ts, granularity):
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _fold(events):
+    totals = defaultdict(lambda: [0, 0.0])
+
+    for _, kind, amount, created_at in events:
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(created_at, granularity), kind)
+            totals[key][0] += 1
+            totals[key][1] += amount or 0
+
+    return totals
+
+def _merge(totals):
+    buckets = {bucket for _, bucket, _ in totals}
+
+    existing = {
+        (r.granularity, r.bucket, r.kind): r
+        for r in ActivityRollup.query.filter(ActivityRollup.bucket.in_(buckets))
+    }
+
+    for key, (count, total) in totals.items():
+        row = existing.get(key)
+        if row is None:
+            granularity, bucket, kind = key
+            db.session.add(ActivityRollup(
+                granularity=granularity,
+                bucket=bucket,
+                kind=kind,
+                count=count,
+                total=total
+            ))
+        else:
+            row.count += count
+            row.total += total
+
+def rollup_activity():
+    state = (
+        RollupState.query
+        .filter_by(name="activity")
+        .with_for_update()
+        .first()
+    )
+    if not state:
+        state = RollupState(name="activity", last_event_id=0)
+        db.session.add(state)
+        db.session.flush()
+
+    # Fold every id up to the newest settled event, whatever its own
+    # created_at: timestamps come from different processes' clocks, so a
+    # lower id can carry a later time, and skipping it while the watermark
+    # moves past would lose it for good.
+    cutoff = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+    bound = (
+        db.session.query(db.func.max(ActivityEvent.id))
+        .filter(
+            ActivityEvent.id > state.last_event_id,
+            ActivityEvent.created_at < cutoff
+        )
+        .scalar()
+    )
+    folded = 0
+    if bound is None:
+        db.session.commit()
+        return folded
+
+    while True:
+        events = (
+            db.session.query(
+                ActivityEvent.id,
+                ActivityEvent.kind,
+                ActivityEvent.amount,
+                ActivityEvent.created_at
+            )
+            .filter(
+                ActivityEvent.id > state.last_event_id,
+                ActivityEvent.id <= bound
+            )
+            .order_by(ActivityEvent.id)
+            .limit(CHUNK_SIZE)
+            .all()
+        )
+        if not events:
+            break
+
+        _merge(_fold(events))
+        state.last_event_id = events[-1].id
+        folded += len(events)
+
+        # rollup rows and the watermark move together, one chunk at a time
+        db.session.commit()
+
+        if len(events) < CHUNK_SIZE:
+            break
+
+        state = (
+            RollupState.query
+            .filter_by(name="activity")
+            .with_for_update()
+            .first()
+        )
+
+    db.session.commit()
+    return folded
+
+# ======================
+# READING (ADMIN SIDE)
+# ======================
+def activity_series(granularity="day", days=90):
+    start = bucket_start(datetime.utcnow(), granularity) - timedelta(days=days)
+
+    rows = (
+        ActivityRollup.query
+        .filter(
+            ActivityRollup.granularity == granularity,
+            ActivityRollup.bucket >= start
+        )
+        .order_by(ActivityRollup.bucket)
+        .all()
+    )
+
+    series = defaultdict(dict)
+    for r in rows:
+        series[r.bucket][r.kind] = {"count": r.count, "total": r.total}
+
+    return [
+        {"bucket": bucket, "kinds": kinds}
+        for bucket, kinds in sorted(series.items())
+    ]
@@ -0,0 +1,158 @@
+from functools import wraps
+
+from flask import Blueprint, jsonify, request, session
+
+from services import (
+    ServiceError,
+    TASK_KINDS,
+    get_current_user,
+    verify_recaptcha,
+    balance_summary,
+    next_task,
+    answer_task,
+    convert_points,
+    request_withdrawal,
+    withdrawal_history,
+    withdrawal_totals
+)
+
+# ======================
+# JSON API (v1)
+# ======================
+# Same rules as the HTML views (both go through services.py), but one
+# compact JSON response per action instead of a redirect + full page.
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if "user" not in session:
+            return error("login required", "unauthorized", 401)
+
+        user = get_current_user()
+        if not user:
+            return error("login required", "unauthorized", 401)
+
+        return f(user, *args, **kwargs)
+    return decorated
+
+def error(message, code, status=400):
+    return jsonify({"error": code, "message": message}), status
+
+def cached_json(data):
+    # ETag over the body: an unchanged balance or history answers 304
+    # with no body at all
+    resp = jsonify(data)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+def payload():
+    data = request.get_json(silent=True)
+    if data is None:
+        return request.form
+    if not isinstance(data, dict):
+        raise ServiceError("Request body must be a JSON object.", "invalid_body")
+    return data
+
+# anything a route doesn't catch itself, e.g. a bad body from payload()
+@api.errorhandler(ServiceError)
+def service_error(e):
+    return error(e.message, e.code)
+
+def withdrawal_json(w):
+    return {
+        "id": w.id,
+        "amount": w.amount,
+        "method": w.method,
+        "status": w.status,
+        "requested_at": w.requested_at.isoformat() if w.requested_at else None,
+        "processed_at": w.processed_at.isoformat() if w.processed_at else None
+    }
+
+# ======================
+# ROUTES
+# ======================
+@api.route("/balance")
+@api_login_required
+def balance(user):
+    return cached_json(balance_summary(user))
+
+@api.route("/tasks/<kind>", methods=["GET"])
+@api_login_required
+def get_task(user, kind):
+    if kind not in TASK_KINDS:
+        return error("unknown task type", "not_found", 404)
+
+    question, remaining = next_task(kind, session)
+
+    resp = jsonify({"question": question, "cooldown": remaining})
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+@api.route("/tasks/<kind>", methods=["POST"])
+@api_login_required
+def post_task(user, kind):
+    if kind not in TASK_KINDS:
+        return error("unknown task type", "not_found", 404)
+
+    try:
+        earned = answer_task(user, kind, str(payload().get("answer", "")), session)
+    except ServiceError as e:
+        return error(e.message, e.code, 429 if e.code == "cooldown" else 400)
+
+    return jsonify({
+        "correct": earned > 0,
+        "earned": earned,
+        "balance": balance_summary(user)
+    })
+
+@api.route("/convert", methods=["POST"])
+@api_login_required
+def convert(user):
+    try:
+        peso = convert_points(user)
+    except ServiceError as e:
+        return error(e.message, e.code)
+
+    return jsonify({"peso": peso, "balance": balance_summary(user)})
+
+@api.route("/withdrawals", methods=["GET"])
+@api_login_required
+def list_withdrawals(user):
+    try:
+        rows, next_cursor = withdrawal_history(
+            user,
+            status=request.args.get("status") or None,
+            before=request.args.get("before")
+        )
+    except ServiceError as e:
+        return error(e.message, e.code)
+
+    return cached_json({
+        "withdrawals": [withdrawal_json(w) for w in rows],
+        "next": next_cursor,
+        "totals": withdrawal_totals(user)
+    })
+
+@api.route("/withdrawals", methods=["POST"])
+@api_login_required
+def create_withdrawal(user):
+    data = payload()
+
+    try:
+        verify_recaptcha(data.get("recaptcha_token"), request.remote_addr)
+        w = request_withdrawal(
+            user,
+            data.get("amount"),
+            data.get("method"),
+            data.get("account"),
+            data.get("notify_email")
+        )
+    except ServiceError as e:
+        return error(e.message, e.code)
+
+    return jsonify({
+        "withdrawal": withdrawal_json(w),
+        "balance": balance_summary(user)
+    }), 201
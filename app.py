@@ -1,9 +1,10 @@
 # ======================
 # IMPORTS
 # ======================
+import csv
+import io
 import os
 import random
-import time
 from datetime import datetime
 
 from flask import (
@@ -12,11 +13,14 @@ from flask import (
     request,
     redirect,
     flash,
+    Response,
     session,
+    stream_with_context,
     url_for
 )
 
 from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
 from sqlalchemy import text
 
 from models import (
@@ -25,11 +29,41 @@ from models import (
     ActivationCode,
     Withdrawal,
     AdminFund,
-    TaskLog
+    TaskLog,
+    MessengerLink,
+    Referral,
+    AbuseFlag,
+    WithdrawalTotals,
+    withdrawal_user_index
 )
 
+from notifications import queue_withdrawal_notification
+from activity import record_activity, activity_series
+from replica import replica_read
+from archive import all_withdrawals
+from ledger import record_balance_change
+from session_store import ServerSessionInterface, make_store
+from ratelimit import RateLimiter, Rule, make_backend as make_rate_backend
+from profiler import SamplingProfiler
+from points_buffer import points_buffer
+from services import (
+    ServiceError,
+    get_current_user,
+    verify_recaptcha,
+    next_task,
+    answer_task,
+    display_points,
+    convert_points as convert_user_points,
+    request_withdrawal,
+    withdrawal_history,
+    withdrawal_totals,
+    ensure_withdrawal_totals,
+    bump_withdrawal_totals
+)
+from api import api
+import messenger_bot
+
 from werkzeug.security import generate_password_hash, check_password_hash
-import requests
 import secrets
 import string
 
@@ -61,27 +95,124 @@ if database_url.startswith("postgres://"):
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# ======================
+# READ REPLICA (OPTIONAL)
+# ======================
+# Views decorated with @replica_read send their SELECTs here.
+replica_url = os.environ.get("DATABASE_REPLICA_URL")
+
+if replica_url:
+    if replica_url.startswith("postgres://"):
+        replica_url = replica_url.replace(
+            "postgres://",
+            "postgresql://",
+            1
+        )
+    app.config["SQLALCHEMY_BINDS"] = {"replica": replica_url}
+
 db.init_app(app)
+app.register_blueprint(api)
+
+# ======================
+# SESSIONS (SERVER-SIDE)
+# ======================
+# The cookie only carries an opaque session id; the data lives in the
+# database (default), in process memory, or in a Redis-compatible server.
+# SESSION_BACKEND=cookie keeps Flask's signed cookie sessions.
+session_backend = os.environ.get("SESSION_BACKEND", "database")
+
+if session_backend != "cookie":
+    app.session_interface = ServerSessionInterface(
+        make_store(app, session_backend, os.environ.get("REDIS_URL"))
+    )
 
 with app.app_context():
     db.create_all()
+    withdrawal_user_index.create(db.engine, checkfirst=True)
 
 # ======================
-# HELPERS
+# RATE LIMITS & LOAD SHEDDING
 # ======================
-def get_current_user():
-    uid = session.get("user")
-    if not isinstance(uid, int):
-        session.clear()
-        return None
-    return User.query.get(uid)
-
-def give_task_reward(user):
-    earned = random.randint(1, 2)
-    user.points += earned
-    db.session.commit()
-    return earned
+# The app runs behind Render's proxy, so by default request.remote_addr is
+# taken from the one X-Forwarded-For hop it adds; otherwise every client
+# would share the proxy's address (one "ip" bucket for the whole site, one
+# signup IP for every referral). Set PROXY_HOPS=0 when serving directly.
+proxy_hops = int(os.environ.get("PROXY_HOPS", "1"))
+if proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+
+RATE_LIMITS = {
+    "signup": [Rule("ip", 5, 300), Rule("username", 3, 300)],
+    "login": [Rule("ip", 20, 300), Rule("username", 5, 300)],
+    "withdraw": [Rule("ip", 10, 300), Rule("user", 3, 300)],
+    "convert_points": [Rule("user", 10, 60)],
+    "api.create_withdrawal": [Rule("ip", 10, 300), Rule("user", 3, 300)],
+    "api.convert": [Rule("user", 10, 60)],
+    "api.post_task": [Rule("user", 10, 60)],
+}
+
+# Once in-flight requests pass SHED_INFLIGHT, "low" routes get a 503;
+# past twice that, "normal" ones too. "high" routes are never shed. The
+# count has to be shared by all workers, so this needs
+# RATE_LIMIT_BACKEND=redis.
+ROUTE_PRIORITY = {
+    "login": "high",
+    "withdraw": "high",
+    "webhook": "high",
+    "admin_dashboard": "high",
+    "admin_withdrawals": "high",
+    "process_withdraw": "high",
+    "about": "low",
+    "terms": "low",
+    "privacy": "low",
+    "referral": "low",
+    "account": "low",
+    "convert_page": "low",
+    "admin_analytics": "low",
+    "export_withdrawals": "low",
+}
+
+RateLimiter(
+    app,
+    make_rate_backend(
+        os.environ.get("RATE_LIMIT_BACKEND", "memory"),
+        os.environ.get("REDIS_URL")
+    ),
+    RATE_LIMITS,
+    ROUTE_PRIORITY,
+    int(os.environ.get("SHED_INFLIGHT", "0"))
+)
+
+# ======================
+# TASK REWARD BUFFER
+# ======================
+# Correct answers are summed per user and written every
+# POINTS_FLUSH_SECONDS or POINTS_FLUSH_EVENTS rewards. POINTS_BUFFER=redis
+# shares the buffer between workers; "off" writes each reward right away.
+# The in-memory buffer is only used when gunicorn runs a single worker
+# (WEB_CONCURRENCY, which gunicorn also reads for its worker count).
+points_buffer.init_app(
+    app,
+    os.environ.get("POINTS_BUFFER", "memory"),
+    os.environ.get("REDIS_URL"),
+    float(os.environ.get("POINTS_FLUSH_SECONDS", "5")),
+    int(os.environ.get("POINTS_FLUSH_EVENTS", "500")),
+    int(os.environ.get("WEB_CONCURRENCY", "1"))
+)
+
+# ======================
+# PROFILER (OFF BY DEFAULT)
+# ======================
+# Switched on from /admin/profiler. Its settings and samples live in the
+# worker process, so it stays off when WEB_CONCURRENCY is above 1.
+profiler = SamplingProfiler(app, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# rows per page in the admin withdrawal queue
+ADMIN_PAGE_SIZE = 50
 
+# ======================
+# HELPERS
+# ======================
 def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -126,6 +257,7 @@ from sqlalchemy import func
 
 @app.route("/admin")
 @admin_required
+@replica_read
 def admin_dashboard():
 
     # ==========================
@@ -136,13 +268,26 @@ def admin_dashboard():
     # ==========================
     # TOTAL PAYOUTS PER USER
     # ==========================
+    # From the running withdrawal_totals counters; only users that have no
+    # counters row yet are summed from hot + archived history.
     payout_map = dict(
         db.session.query(
-            Withdrawal.user_id,
-            func.sum(Withdrawal.amount)
+            WithdrawalTotals.user_id,
+            WithdrawalTotals.approved_amount
+        ).all()
+    )
+
+    no_totals = db.select(User.user_id).where(
+        ~db.exists().where(WithdrawalTotals.user_id == User.user_id)
+    )
+    history = all_withdrawals(no_totals)
+    payout_map.update(
+        db.session.query(
+            history.c.user_id,
+            func.sum(history.c.amount)
         )
-        .filter(Withdrawal.status == "approved")
-        .group_by(Withdrawal.user_id)
+        .filter(history.c.status == "approved")
+        .group_by(history.c.user_id)
         .all()
     )
 
@@ -202,14 +347,163 @@ def admin_dashboard():
 
 @app.route("/admin/withdrawals")
 @admin_required
+@replica_read
 def admin_withdrawals():
-    withdrawals = Withdrawal.query.order_by(
-        Withdrawal.requested_at.desc()
-    ).all()
+    flagged_only = request.args.get("flagged") == "1"
+    status = request.args.get("status", "pending")
+    if status not in ("pending", "approved", "rejected", "all"):
+        status = "pending"
+
+    # The pending work queue only ever needs the hot table (pending rows
+    # are never archived); processed ones and "all" are history and read
+    # hot + archive. Both page newest first by id, which is unique across
+    # the two. abuse_scan.py writes abuse_flags, shown next to each request.
+    source = Withdrawal.__table__ if status == "pending" else all_withdrawals()
+    query = (
+        db.select(source, AbuseFlag.score, AbuseFlag.reasons)
+        .outerjoin(AbuseFlag, AbuseFlag.user_id == source.c.user_id)
+        .order_by(source.c.id.desc())
+        .limit(ADMIN_PAGE_SIZE + 1)
+    )
+    if status != "all":
+        query = query.where(source.c.status == status)
+    if flagged_only:
+        query = query.where(AbuseFlag.user_id.isnot(None))
+
+    before = request.args.get("before", type=int)
+    if before:
+        query = query.where(source.c.id < before)
+
+    withdrawals = db.session.execute(query).all()
+    next_before = None
+    if len(withdrawals) > ADMIN_PAGE_SIZE:
+        withdrawals = withdrawals[:ADMIN_PAGE_SIZE]
+        next_before = withdrawals[-1].id
 
     return render_template(
         "admin/withdrawals.html",
-        withdrawals=withdrawals
+        withdrawals=withdrawals,
+        flagged_only=flagged_only,
+        status=status,
+        next_before=next_before
+    )
+
+@app.route("/admin/withdrawals/export")
+@admin_required
+@replica_read
+def export_withdrawals():
+    # executed here, while @replica_read still routes it; the rows are then
+    # fetched 1000 at a time as the response is written out
+    history = all_withdrawals()
+    rows = db.session.execute(
+        db.select(history).order_by(history.c.id),
+        execution_options={"yield_per": 1000}
+    )
+
+    def generate():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow([
+            "id", "user_id", "amount", "method", "account_info",
+            "status", "requested_at", "processed_at", "notify_email"
+        ])
+
+        for chunk in rows.partitions():
+            for w in chunk:
+                writer.writerow([
+                    w.id, w.user_id, w.amount, w.method, w.account_info,
+                    w.status, w.requested_at, w.processed_at, w.notify_email
+                ])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+        yield out.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition": "attachment; filename=withdrawals.csv"
+        }
+    )
+
+@app.route("/admin/analytics")
+@admin_required
+@replica_read
+def admin_analytics():
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ("hour", "day"):
+        granularity = "day"
+
+    # 90 days of daily buckets, or the last 7 days hour by hour
+    days = 90 if granularity == "day" else 7
+    series = activity_series(granularity, days)
+
+    peak_tasks = max(
+        (b["kinds"].get("task_completed", {}).get("count", 0) for b in series),
+        default=0
+    )
+
+    return render_template(
+        "admin/analytics.html",
+        series=series,
+        granularity=granularity,
+        days=days,
+        peak_tasks=peak_tasks
+    )
+
+@app.route("/admin/profiler", methods=["GET", "POST"])
+@admin_required
+def admin_profiler():
+    if request.method == "POST":
+        if request.form.get("action") == "reset":
+            profiler.reset()
+            flash("Profiler data cleared", "success")
+            return redirect("/admin/profiler")
+
+        try:
+            sample_rate = float(request.form.get("sample_rate") or 0)
+            user_id = request.form.get("user_id", "").strip()
+            user_id = int(user_id) if user_id else None
+        except ValueError:
+            flash("Invalid profiler settings", "error")
+            return redirect("/admin/profiler")
+
+        if not profiler.configure(
+            enabled=request.form.get("enabled") == "1",
+            sample_rate=sample_rate,
+            route=request.form.get("route", "").strip(),
+            user_id=user_id
+        ):
+            flash("The profiler only runs with a single worker (WEB_CONCURRENCY=1)", "error")
+            return redirect("/admin/profiler")
+
+        flash("Profiler settings saved", "success")
+        return redirect("/admin/profiler")
+
+    routes, recent = profiler.summary()
+
+    return render_template(
+        "admin/profiler.html",
+        profiler=profiler,
+        routes=routes,
+        recent=recent,
+        endpoints=sorted(app.view_functions)
+    )
+
+@app.route("/admin/profiler/stacks.txt")
+@admin_required
+def admin_profiler_stacks():
+    endpoint = request.args.get("route")
+
+    return Response(
+        profiler.collapsed(endpoint),
+        mimetype="text/plain",
+        headers={
+            "Content-Disposition":
+                f"attachment; filename={endpoint or 'all'}.folded.txt"
+        }
     )
 
 @app.route("/admin/withdraw/<int:w_id>/<action>")
@@ -221,9 +515,11 @@ def process_withdraw(w_id, action):
         return redirect("/admin/withdrawals")
 
     user = User.query.filter_by(user_id=w.user_id).first()
+    ensure_withdrawal_totals(w.user_id)
 
     if action == "approve":
         w.status = "approved"
+        record_activity("withdrawal_approved", user.id if user else None, w.amount)
 
     # ===== AUTO-DEDUCT FUNDS =====
         fund = AdminFund(
@@ -235,9 +531,18 @@ def process_withdraw(w_id, action):
  
     elif action == "reject":
         user.cash_balance += w.amount
+        record_balance_change(w.user_id, w.amount, "withdrawal_refund", w.id)
         w.status = "rejected"
+        record_activity("withdrawal_rejected", user.id, w.amount)
+
+    else:
+        return redirect("/admin/withdrawals")
 
     w.processed_at = db.func.now()
+    bump_withdrawal_totals(w.user_id, w.amount, "pending", w.status)
+
+    # ===== NOTIFY USER (SENT BY notification_worker.py) =====
+    queue_withdrawal_notification(w)
     db.session.commit()
 
     return redirect("/admin/withdrawals")
@@ -317,23 +622,13 @@ def signup():
     # =========================
     # reCAPTCHA v3 VERIFY
     # =========================
-    token = request.form.get("recaptcha_token")
-    if not token:
-        flash("Captcha missing.", "error")
-        return redirect("/signup")
-
-    r = requests.post(
-        "https://www.google.com/recaptcha/api/siteverify",
-        data={
-            "secret": os.environ.get("RECAPTCHA_SECRET_KEY"),
-            "response": token,
-            "remoteip": request.remote_addr
-        }
-    )
-    result = r.json()
-
-    if not result.get("success") or result.get("score", 0) < 0.3:
-        flash("Suspicious activity detected.", "error")
+    try:
+        verify_recaptcha(
+            request.form.get("recaptcha_token"),
+            request.remote_addr
+        )
+    except ServiceError as e:
+        flash(e.message, "error")
         return redirect("/signup")
 
     # =========================
@@ -358,6 +653,7 @@ def signup():
     )
 
     db.session.add(new_user)
+    record_balance_change(user_id, 0, "opening")
     code.is_used = 1
     code.used_by = user_id
 
@@ -368,7 +664,15 @@ def signup():
             inviter.referrals += 1
             inviter.referral_balance += 50
             inviter.cash_balance += 50
+            record_balance_change(inviter.user_id, 50, "referral_bonus")
 
+            db.session.add(Referral(
+                referrer_id=inviter.user_id,
+                referred_id=user_id,
+                signup_ip=request.remote_addr
+            ))
+
+    record_activity("signup")
     db.session.commit()
     session.pop("referrer", None)
 
@@ -386,23 +690,13 @@ def login():
     # =========================
     # reCAPTCHA v3 VERIFY
     # =========================
-    token = request.form.get("recaptcha_token")
-    if not token:
-        flash("Captcha missing.", "error")
-        return redirect("/login")
-
-    r = requests.post(
-        "https://www.google.com/recaptcha/api/siteverify",
-        data={
-            "secret": os.environ.get("RECAPTCHA_SECRET_KEY"),
-            "response": token,
-            "remoteip": request.remote_addr
-        }
-    )
-    result = r.json()
-
-    if not result.get("success") or result.get("score", 0) < 0.3:
-        flash("Suspicious activity detected.", "error")
+    try:
+        verify_recaptcha(
+            request.form.get("recaptcha_token"),
+            request.remote_addr
+        )
+    except ServiceError as e:
+        flash(e.message, "error")
         return redirect("/login")
 
     # =========================
@@ -427,7 +721,11 @@ def dashboard():
         return redirect("/signup")
 
     user = get_current_user()
-    return render_template("dashboard.html", user=user)
+    return render_template(
+        "dashboard.html",
+        user=user,
+        points=display_points(user)
+    )
 
 @app.route("/referral")
 def referral():
@@ -446,208 +744,54 @@ def account():
     user = get_current_user()
     return render_template("account.html", user=user)
 
-def generate_hard_task():
-    task_type = random.choice([
-        "counting",
-        "big_add",
-        "big_sub",
-        "multiply",
-        "divide",
-        "word",
-        "logic"
-    ])
-
-    # 1️⃣ COUNTING / CAPTCHA
-    if task_type == "counting":
-        a1 = random.randint(1, 9)
-        a2 = random.randint(1, 9)
-        question = (
-            f"There are {a1} apples, 2 bananas, "
-            f"and {a2} apples again. "
-            f"How many apples are there?"
-        )
-        answer = a1 + a2
-
-    # 2️⃣ BIG ADDITION
-    elif task_type == "big_add":
-        a = random.randint(10000, 999999)
-        b = random.randint(10000, 999999)
-        question = f"{a} + {b}"
-        answer = a + b
-
-    # 3️⃣ BIG SUBTRACTION
-    elif task_type == "big_sub":
-        a = random.randint(100000, 999999)
-        b = random.randint(10000, a)
-        question = f"{a} - {b}"
-        answer = a - b
-
-    # 4️⃣ MULTIPLICATION
-    elif task_type == "multiply":
-        a = random.randint(100, 999)
-        b = random.randint(10, 99)
-        question = f"{a} × {b}"
-        answer = a * b
-
-    # 5️⃣ DIVISION (CLEAN)
-    elif task_type == "divide":
-        b = random.randint(2, 20)
-        answer = random.randint(10, 500)
-        a = b * answer
-        question = f"{a} ÷ {b}"
-
-    # 6️⃣ WORD PROBLEM
-    elif task_type == "word":
-        box = random.randint(5, 20)
-        per_box = random.randint(50, 200)
-        question = (
-            f"A warehouse has {box} boxes. "
-            f"Each box contains {per_box} items. "
-            f"How many items are there in total?"
-        )
-        answer = box * per_box
-
-    # 7️⃣ LOGIC CAPTCHA
-    else:
-        nums = random.sample(range(1, 30), 6)
-        question = (
-            f"Count the even numbers only: "
-            f"{', '.join(map(str, nums))}"
-        )
-        answer = len([n for n in nums if n % 2 == 0])
-
-    return question, answer
-
-def generate_color_task():
-    colors = [
-        "red", "blue", "green", "yellow", "orange",
-        "purple", "pink", "brown", "black", "white",
-        "gray", "cyan", "magenta", "lime", "teal"
-    ]
-
-    sequence = random.sample(colors, 6)
-    index = random.randint(1, 6)
-
-    question = (
-        f"Memorize the colors:\n"
-        f"{', '.join(sequence)}\n\n"
-        f"What is the {index}th color?"
-    )
-
-    answer = sequence[index - 1]
-    return question, answer
-
-import random
-
-@app.route("/task", methods=["GET", "POST"])
-def task():
+def task_view(kind, endpoint, template, categories):
     if "user" not in session:
         return redirect("/login")
 
     user = get_current_user()
-
-    COOLDOWN = 30
-    now = int(time.time())
-    last_time = session.get("last_task_time", 0)
-    remaining = COOLDOWN - (now - last_time)
+    ok_category, wrong_category = categories
 
     # =========================
     # SUBMIT ANSWER
     # =========================
     if request.method == "POST":
-
-        if remaining > 0:
-            flash("Please wait 30 seconds before next task", "info")
-            return redirect("/task")
-
-        correct = session.get("correct_answer")
-        user_answer = request.form.get("answer", "").strip()
-
-        if user_answer.isdigit() and int(user_answer) == correct:
-            earned = random.randint(1, 2)
-            user.points += earned
-            flash(f"Correct! +{earned} points 🎉")
+        try:
+            earned = answer_task(user, kind, request.form.get("answer"), session)
+        except ServiceError as e:
+            flash(e.message, "info")
+            return redirect(endpoint)
+
+        if earned:
+            flash(f"Correct! +{earned} points 🎉", *ok_category)
         else:
-            flash("Wrong answer ❌")
-
-        session["last_task_time"] = now
-        db.session.commit()
+            flash("Wrong answer ❌", *wrong_category)
 
-        return redirect("/task")
+        return redirect(endpoint)
 
     # =========================
     # SHOW TASK OR COOLDOWN
     # =========================
-    if remaining > 0:
-        return render_template(
-            "task.html",
-            user=user,
-            question=None,
-            remaining=remaining
-        )
-
-    question, answer = generate_hard_task()
-    session["correct_answer"] = answer
+    question, remaining = next_task(kind, session)
 
     return render_template(
-        "task.html",
+        template,
         user=user,
+        points=display_points(user),
         question=question,
-        remaining=0
+        remaining=remaining
     )
 
+@app.route("/task", methods=["GET", "POST"])
+def task():
+    return task_view("math", "/task", "task.html", ((), ()))
+
 @app.route("/color-task", methods=["GET", "POST"])
 def color_task():
-    if "user" not in session:
-        return redirect("/login")
-
-    user = get_current_user()
-
-    COOLDOWN = 30
-    now = int(time.time())
-    last_time = session.get("last_color_task_time", 0)
-    remaining = COOLDOWN - (now - last_time)
-
-    # =========================
-    # SUBMIT ANSWER
-    # =========================
-    if request.method == "POST":
-        if remaining > 0:
-            flash("Please wait 30 seconds before next task", "info")
-            return redirect("/color-task")
-
-        correct = session.get("color_correct")
-        user_answer = request.form.get("answer", "").lower().strip()
-
-        if user_answer == correct:
-            earned = give_task_reward(user)
-            flash(f"Correct! +{earned} points 🎉", "success")
-        else:
-            flash("Wrong answer ❌", "error")
-
-        session["last_color_task_time"] = now
-        db.session.commit()
-        return redirect("/color-task")
-
-    # =========================
-    # SHOW TASK / COOLDOWN
-    # =========================
-    if remaining > 0:
-        return render_template(
-            "color_task.html",
-            user=user,
-            question=None,
-            remaining=remaining
-        )
-
-    question, answer = generate_color_task()
-    session["color_correct"] = answer
-
-    return render_template(
+    return task_view(
+        "color",
+        "/color-task",
         "color_task.html",
-        user=user,
-        question=question,
-        remaining=0
+        (("success",), ("error",))
     )
 
 @app.route("/withdraw", methods=["GET", "POST"])
@@ -667,55 +811,59 @@ def withdraw():
     # =========================
     # reCAPTCHA v3 VERIFY
     # =========================
-    token = request.form.get("recaptcha_token")
-    if not token:
-        flash("Captcha missing.", "error")
-        return redirect("/withdraw")
-
-    r = requests.post(
-        "https://www.google.com/recaptcha/api/siteverify",
-        data={
-            "secret": os.environ.get("RECAPTCHA_SECRET_KEY"),
-            "response": token,
-            "remoteip": request.remote_addr
-        }
-    )
-    result = r.json()
-
-    if not result.get("success") or result.get("score", 0) < 0.3:
-        flash("Suspicious activity detected.", "error")
+    try:
+        verify_recaptcha(
+            request.form.get("recaptcha_token"),
+            request.remote_addr
+        )
+    except ServiceError as e:
+        flash(e.message, "error")
         return redirect("/withdraw")
 
     # =========================
     # EXISTING WITHDRAW LOGIC
     # =========================
-    amount = float(request.form["amount"])
-    method = request.form["method"]
-    account = request.form["account"]
-    notify_email = request.form["notify_email"]
-
-    if amount < 300:
-        flash("Minimum withdrawal is ₱300.", "error")
+    try:
+        request_withdrawal(
+            user,
+            request.form["amount"],
+            request.form["method"],
+            request.form["account"],
+            request.form["notify_email"]
+        )
+    except ServiceError as e:
+        flash(e.message, "error")
         return redirect("/withdraw")
 
-    if amount > user.cash_balance:
-        flash("Insufficient balance.", "error")
-        return redirect("/withdraw")
+    flash("Withdrawal request submitted!", "success")
+    return redirect("/dashboard")
 
-    w = Withdrawal(
-        user_id=user.user_id,
-        amount=amount,
-        method=method,
-        account_info=account,
-        notify_email=notify_email
-    )
+@app.route("/my-withdrawals")
+def my_withdrawals():
+    if "user" not in session:
+        return redirect("/login")
 
-    user.cash_balance -= amount
-    db.session.add(w)
-    db.session.commit()
+    user = get_current_user()
+    status = request.args.get("status") or None
 
-    flash("Withdrawal request submitted!", "success")
-    return redirect("/dashboard")
+    try:
+        withdrawals, next_cursor = withdrawal_history(
+            user,
+            status=status,
+            before=request.args.get("before")
+        )
+    except ServiceError as e:
+        flash(e.message, "error")
+        return redirect("/my-withdrawals")
+
+    return render_template(
+        "my_withdrawals.html",
+        user=user,
+        withdrawals=withdrawals,
+        totals=withdrawal_totals(user),
+        status=status,
+        next_cursor=next_cursor
+    )
 
 @app.route("/convert", methods=["POST"])
 def convert_points():
@@ -724,20 +872,12 @@ def convert_points():
 
     user = get_current_user()
 
-    # CHECK MINIMUM POINTS
-    if user.points < 200:
-        flash("You need at least 200 points to convert.")
+    try:
+        peso = convert_user_points(user)
+    except ServiceError as e:
+        flash(e.message)
         return redirect("/dashboard")
 
-    # RANDOM PESO VALUE
-    peso = round(random.uniform(2.0, 2.5), 2)
-
-    # DEDUCT POINTS & ADD CASH
-    user.points -= 200
-    user.cash_balance += peso
-
-    db.session.commit()
-
     flash(f"Converted 200 points to ₱{peso}")
     return redirect("/dashboard")
 
@@ -747,7 +887,11 @@ def convert_page():
         return redirect("/login")
 
     user = get_current_user()
-    return render_template("convert.html", user=user)
+    return render_template(
+        "convert.html",
+        user=user,
+        points=display_points(user)
+    )
 
 @app.route("/about")
 def about():
@@ -766,6 +910,68 @@ def logout():
     session.clear()
     return redirect("/signup")
 
+# ======================
+# MESSENGER
+# ======================
+@app.route("/webhook", methods=["GET"])
+def verify_webhook():
+    mode = request.args.get("hub.mode")
+    token = request.args.get("hub.verify_token")
+    challenge = request.args.get("hub.challenge")
+
+    if mode == "subscribe" and token == messenger_bot.VERIFY_TOKEN:
+        return challenge, 200
+    return "Forbidden", 403
+
+# Facebook only waits a few seconds for a 200, so this just stores the raw
+# events. messenger_worker.py does the actual work in batches.
+@app.route("/webhook", methods=["POST"])
+def webhook():
+    raw = request.get_data()
+    signature = request.headers.get("X-Hub-Signature-256")
+
+    if not messenger_bot.verify_signature(raw, signature):
+        return "Forbidden", 403
+
+    data = request.get_json(silent=True)
+    if not data or data.get("object") != "page":
+        return "ok", 200
+
+    messenger_bot.enqueue_events(data)
+    return "ok", 200
+
+@app.route("/activate-messenger", methods=["POST"])
+@login_required
+def activate_messenger():
+    messenger_id = request.form.get("messenger_id", "").strip()
+
+    if not messenger_id:
+        flash("Messenger ID is required.", "error")
+        return redirect(url_for("messenger_connect"))
+
+    psid = messenger_id.replace("IFD-", "")
+    link = MessengerLink.query.filter_by(psid=psid).first()
+    user = get_current_user()
+
+    if not link or (link.user_id and link.user_id != user.id):
+        flash("❌ Invalid or unverified Messenger ID", "error")
+        return redirect(url_for("messenger_connect"))
+
+    link.user_id = user.id
+    link.active = True
+
+    # the worker sends the dashboard, keeping Graph API calls off this request
+    messenger_bot.enqueue_command(psid, "dashboard")
+    db.session.commit()
+
+    flash("✅ Messenger Activated! Check Messenger now.", "success")
+    return redirect(url_for("dashboard"))
+
+@app.route("/messenger")
+@login_required
+def messenger_connect():
+    return render_template("messenger/connect.html")
+
 # ======================
 # RUN SERVER
 # ======================
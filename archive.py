@@ -0,0 +1,151 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, text, union_all
+
+from models import db, Withdrawal, WithdrawalArchive, TaskLog, TaskLogArchive
+
+# ======================
+# CONFIG
+# ======================
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+# small batches keep row locks short and WAL bursts small
+BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+
+WITHDRAWAL_COLUMNS = (
+    "id", "user_id", "amount", "method", "account_info",
+    "status", "requested_at", "processed_at", "notify_email"
+)
+
+_partitions = set()
+
+# ======================
+# POSTGRES PARTITIONS
+# ======================
+def _month_start(ts):
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _next_month(ts):
+    return (ts.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def ensure_partitions(table, timestamps):
+    if db.engine.dialect.name != "postgresql":
+        return set()
+
+    wanted = {(table, None)}
+    wanted.update((table, _month_start(ts)) for ts in timestamps if ts)
+    created = wanted - _partitions
+
+    for key in created:
+        _, month = key
+
+        if month is None:
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table}_default "
+                f"PARTITION OF {table} DEFAULT"
+            ))
+        else:
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table}_p{month:%Y%m} "
+                f"PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') "
+                f"TO ('{_next_month(month):%Y-%m-%d}')"
+            ))
+
+    return created
+
+# ======================
+# BATCH MOVER
+# ======================
+def _move(source, target, condition, order_col, partition_col):
+    moved = 0
+
+    # SQLite tables created before sqlite_autoincrement was set hand out
+    # max(id) + 1, so deleting the newest row would let its id be reused
+    # while the archive still holds it. Always leave that one row behind.
+    if db.engine.dialect.name == "sqlite":
+        condition = db.and_(
+            condition,
+            source.c.id < select(db.func.max(source.c.id)).scalar_subquery()
+        )
+
+    while True:
+        rows = db.session.execute(
+            select(source)
+            .where(condition)
+            .order_by(order_col)
+            .limit(BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).mappings().all()
+
+        if not rows:
+            break
+
+        now = datetime.utcnow()
+        created = ensure_partitions(
+            target.name,
+            [r[partition_col] for r in rows]
+        )
+
+        db.session.execute(
+            insert(target),
+            [dict(r, archived_at=now) for r in rows]
+        )
+        db.session.execute(
+            delete(source).where(source.c.id.in_([r["id"] for r in rows]))
+        )
+
+        # each batch is its own short transaction
+        db.session.commit()
+        _partitions.update(created)
+        moved += len(rows)
+
+        if len(rows) < BATCH_SIZE:
+            break
+
+    return moved
+
+def archive_withdrawals(older_than_days=ARCHIVE_AFTER_DAYS):
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    source = Withdrawal.__table__
+
+    return _move(
+        source,
+        WithdrawalArchive.__table__,
+        db.and_(
+            source.c.status.in_(("approved", "rejected")),
+            source.c.processed_at < cutoff,
+            source.c.requested_at.isnot(None)
+        ),
+        source.c.id,
+        "requested_at"
+    )
+
+def archive_task_logs(older_than_days=ARCHIVE_AFTER_DAYS):
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    source = TaskLog.__table__
+
+    return _move(
+        source,
+        TaskLogArchive.__table__,
+        source.c.last_task_at < cutoff,
+        source.c.id,
+        "last_task_at"
+    )
+
+# ======================
+# TRANSPARENT READS
+# ======================
+# Hot and archived withdrawals as one selectable with the Withdrawal
+# column names, for history views, totals and exports. `user_ids` (a list or
+# a subquery of users.user_id) filters inside both halves, so each can use
+# its user index instead of scanning before the union.
+def all_withdrawals(user_ids=None):
+    parts = []
+    for table in (Withdrawal.__table__, WithdrawalArchive.__table__):
+        part = select(*(table.c[name] for name in WITHDRAWAL_COLUMNS))
+        if user_ids is not None:
+            part = part.where(table.c.user_id.in_(user_ids))
+        parts.append(part)
+
+    return union_all(*parts).subquery("all_withdrawals")
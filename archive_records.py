@@ -0,0 +1,16 @@
+import sys
+
+from app import app
+from archive import archive_withdrawals, archive_task_logs, ARCHIVE_AFTER_DAYS
+
+
+# Run from cron (e.g. nightly). Optional first argument overrides the age
+# in days: python archive_records.py 30
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+
+    with app.app_context():
+        withdrawals = archive_withdrawals(days)
+        task_logs = archive_task_logs(days)
+
+    print(f"[OK] Archived {withdrawals} withdrawals, {task_logs} task logs")
@@ -0,0 +1,215 @@
+from sqlalchemy import and_, case, create_engine, exists, func, insert, literal, select, update
+
+from models import db, User, BalanceTransaction
+from archive import all_withdrawals
+
+# Balances are pesos with centavos; anything closer than this is equal
+TOLERANCE = 0.005
+
+WITHDRAWAL_KINDS = ("withdrawal", "withdrawal_refund")
+
+# ======================
+# RECORDING (WEB SIDE)
+# ======================
+# Call next to every change of users.cash_balance, with the signed amount.
+# Only adds to the session, so the entry commits (or rolls back) together
+# with the balance change. Every account starts with an "opening" entry,
+# which marks the point from which the ledger covers it.
+def record_balance_change(user_id, amount, kind, ref_id=None):
+    db.session.add(BalanceTransaction(
+        user_id=user_id,
+        amount=amount,
+        kind=kind,
+        ref_id=ref_id
+    ))
+
+# ======================
+# RECONCILIATION (WORKER SIDE)
+# ======================
+# Runs in reconcile_balances.py worker processes, each with its own engine.
+# A chunk is the users with lo <= users.id < hi; every query is limited to
+# that range, so memory stays bounded by the chunk size.
+_engine = None
+
+def init_worker(database_url):
+    global _engine
+    _engine = create_engine(database_url)
+
+def _in_chunk(lo, hi):
+    users = User.__table__
+    return and_(users.c.id >= lo, users.c.id < hi)
+
+def seed_openings(conn, lo, hi):
+    # Accounts from before the ledger get an opening entry for whatever
+    # their balance holds beyond the entries they already have, dated at
+    # their first entry so the withdrawal cross-check starts there. One
+    # INSERT ... SELECT, so balance and ledger are read from one snapshot.
+    users = User.__table__
+    bt = BalanceTransaction.__table__
+
+    existing = (
+        select(
+            bt.c.user_id,
+            func.sum(bt.c.amount).label("total"),
+            func.min(bt.c.created_at).label("first")
+        )
+        .join(users, users.c.user_id == bt.c.user_id)
+        .where(_in_chunk(lo, hi))
+        .group_by(bt.c.user_id)
+        .subquery()
+    )
+    has_opening = exists().where(
+        bt.c.user_id == users.c.user_id,
+        bt.c.kind == "opening"
+    )
+
+    result = conn.execute(insert(bt).from_select(
+        ["user_id", "amount", "kind", "created_at"],
+        select(
+            users.c.user_id,
+            func.coalesce(users.c.cash_balance, 0)
+            - func.coalesce(existing.c.total, 0),
+            literal("opening"),
+            func.coalesce(existing.c.first, func.now())
+        )
+        .select_from(users.outerjoin(
+            existing, existing.c.user_id == users.c.user_id
+        ))
+        .where(_in_chunk(lo, hi), ~has_opening)
+    ))
+    return result.rowcount
+
+def _ledger_totals(conn, lo, hi):
+    users = User.__table__
+    bt = BalanceTransaction.__table__
+
+    rows = conn.execute(
+        select(
+            bt.c.user_id,
+            func.sum(bt.c.amount),
+            func.sum(case(
+                (bt.c.kind.in_(WITHDRAWAL_KINDS), bt.c.amount),
+                else_=0
+            )),
+            func.min(case((bt.c.kind == "opening", bt.c.created_at)))
+        )
+        .join(users, users.c.user_id == bt.c.user_id)
+        .where(_in_chunk(lo, hi))
+        .group_by(bt.c.user_id)
+    )
+    return {uid: (total, withdrawals, opened_at)
+            for uid, total, withdrawals, opened_at in rows}
+
+def _history_totals(conn, lo, hi):
+    # What the withdrawal history (hot + archive) says the ledger's
+    # withdrawal entries should add up to since each account's opening:
+    # minus every request, plus every rejection refunded.
+    users = User.__table__
+    bt = BalanceTransaction.__table__
+
+    opening = (
+        select(bt.c.user_id, func.min(bt.c.created_at).label("at"))
+        .join(users, users.c.user_id == bt.c.user_id)
+        .where(_in_chunk(lo, hi), bt.c.kind == "opening")
+        .group_by(bt.c.user_id)
+        .subquery()
+    )
+    history = all_withdrawals(
+        select(users.c.user_id).where(_in_chunk(lo, hi))
+    )
+
+    rows = conn.execute(
+        select(
+            history.c.user_id,
+            func.sum(case(
+                (history.c.requested_at >= opening.c.at, -history.c.amount),
+                else_=0
+            )),
+            func.sum(case(
+                (and_(
+                    history.c.status == "rejected",
+                    history.c.processed_at >= opening.c.at
+                ), history.c.amount),
+                else_=0
+            ))
+        )
+        .join(opening, opening.c.user_id == history.c.user_id)
+        .group_by(history.c.user_id)
+    )
+    return {uid: (debits or 0) + (refunds or 0) for uid, debits, refunds in rows}
+
+def reconcile_chunk(args):
+    lo, hi, seed, apply = args
+    users = User.__table__
+    stats = {"users": 0, "seeded": 0, "mismatched": 0, "corrected": 0,
+             "unseeded": 0}
+    report = []
+
+    if seed:
+        with _engine.begin() as conn:
+            stats["seeded"] = seed_openings(conn, lo, hi)
+
+    # all reads from one snapshot, so a balance change committed halfway
+    # through can't show up as drift
+    conn = _engine.connect()
+    if conn.dialect.name == "postgresql":
+        conn = conn.execution_options(isolation_level="REPEATABLE READ")
+
+    with conn, conn.begin():
+        ledger = _ledger_totals(conn, lo, hi)
+        history = _history_totals(conn, lo, hi)
+        balances = conn.execute(
+            select(users.c.id, users.c.user_id, users.c.cash_balance)
+            .where(_in_chunk(lo, hi))
+            .order_by(users.c.id)
+        ).all()
+
+    corrections = []
+    for row_id, uid, observed in balances:
+        stats["users"] += 1
+        total, withdrawals, opened_at = ledger.get(uid, (0, 0, None))
+        expected = round(total or 0, 2)
+        diff = round((observed or 0) - expected, 2)
+        notes = []
+
+        if opened_at is None:
+            # not covered by the ledger yet; never corrected
+            if abs(diff) < TOLERANCE:
+                continue
+            stats["unseeded"] += 1
+            notes.append("no opening entry (run with --seed-opening)")
+        else:
+            expected_withdrawals = round(history.get(uid, 0), 2)
+            if abs((withdrawals or 0) - expected_withdrawals) >= TOLERANCE:
+                notes.append(
+                    f"withdrawal entries {withdrawals or 0:.2f} != "
+                    f"history {expected_withdrawals:.2f}"
+                )
+            if abs(diff) >= TOLERANCE:
+                notes.append("balance drift")
+                if apply:
+                    corrections.append((len(report), row_id, observed, expected))
+
+            if not notes:
+                continue
+
+        stats["mismatched"] += 1
+        report.append([row_id, uid, observed, expected, diff, "; ".join(notes)])
+
+    # Each correction only applies if the balance is still the value that
+    # was compared; one that changed since is left for the next run.
+    if corrections:
+        with _engine.begin() as conn:
+            for index, row_id, observed, expected in corrections:
+                result = conn.execute(
+                    update(users)
+                    .where(users.c.id == row_id, users.c.cash_balance == observed)
+                    .values(cash_balance=expected)
+                )
+                if result.rowcount:
+                    stats["corrected"] += 1
+                    report[index][-1] += "; corrected"
+                else:
+                    report[index][-1] += "; changed since read, skipped"
+
+    return stats, report
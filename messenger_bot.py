@@ -0,0 +1,359 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import requests
+from sqlalchemy import insert, inspect
+
+from models import db, User, TaskLog, MessengerLink, MessengerEvent
+from tasks import generate_hard_task
+from activity import record_activity
+from services import balance_summary
+from work_queue import claim_rows
+
+# ======================
+# CONFIG
+# ======================
+PAGE_ACCESS_TOKEN = os.environ.get("PAGE_ACCESS_TOKEN")
+VERIFY_TOKEN = os.environ.get("VERIFY_TOKEN")
+APP_SECRET = os.environ.get("FB_APP_SECRET")
+
+GRAPH_URL = "https://graph.facebook.com/v18.0/me/messages"
+
+BATCH_SIZE = int(os.environ.get("MESSENGER_BATCH_SIZE", "200"))
+POLL_INTERVAL = float(os.environ.get("MESSENGER_POLL_INTERVAL", "1"))
+CLAIM_TIMEOUT = 120        # reclaim events stuck in "processing" after a crash
+COOLDOWN = 30
+
+# keep-alive connection to the Graph API for the worker's replies
+graph = requests.Session()
+
+# ======================
+# INGESTION (WEB SIDE)
+# ======================
+def verify_signature(raw_body, header):
+    if not APP_SECRET or not header or not header.startswith("sha256="):
+        return False
+
+    expected = hmac.new(
+        APP_SECRET.encode(),
+        raw_body,
+        hashlib.sha256
+    ).hexdigest()
+
+    return hmac.compare_digest(expected, header[len("sha256="):])
+
+# Only messages people send and button postbacks need an answer. Delivery
+# and read receipts, reactions, echoes of the page's own replies and the
+# like are dropped: answering them would answer every reply we send.
+def _is_actionable(event):
+    if "postback" in event:
+        return True
+    message = event.get("message")
+    return isinstance(message, dict) and not message.get("is_echo")
+
+def _event_mid(event):
+    if "message" in event:
+        return event["message"].get("mid")
+    if "postback" in event:
+        return event["postback"].get("mid")
+    return None
+
+def enqueue_events(data):
+    now = datetime.utcnow()
+    rows = []
+
+    for entry in data.get("entry", []):
+        for event in entry.get("messaging", []):
+            if not _is_actionable(event):
+                continue
+
+            psid = event.get("sender", {}).get("id")
+            if not psid:
+                continue
+
+            rows.append({
+                "mid": _event_mid(event),
+                "psid": psid,
+                "payload": json.dumps(event, separators=(",", ":")),
+                "status": "pending",
+                "received_at": now
+            })
+
+    if rows:
+        # one multi-row INSERT, no per-event ORM work on the hot path
+        db.session.execute(insert(MessengerEvent), rows)
+        db.session.commit()
+
+    return len(rows)
+
+def enqueue_command(psid, text):
+    event = {"sender": {"id": psid}, "message": {"text": text}}
+    db.session.add(MessengerEvent(
+        psid=psid,
+        payload=json.dumps(event, separators=(",", ":"))
+    ))
+
+# ======================
+# OUTGOING MESSAGES
+# ======================
+def send_message(psid, text):
+    payload = {
+        "recipient": {"id": psid},
+        "message": {"text": text},
+        "messaging_type": "RESPONSE"
+    }
+    graph.post(
+        GRAPH_URL,
+        params={"access_token": PAGE_ACCESS_TOKEN},
+        json=payload,
+        timeout=10
+    )
+
+def dashboard_text(user):
+    summary = balance_summary(user)
+    return (
+        f"📊 iFund Dashboard\n"
+        f"👤 {user.username}\n"
+        f"⭐ Points: {summary['points']}\n"
+        f"💰 Balance: ₱{summary['cash']:.2f}\n"
+        f"👥 Referrals: {summary['referrals']}\n\n"
+        f"Reply TASK to get a task, or DASHBOARD to see this again."
+    )
+
+# ======================
+# BATCH PROCESSING (WORKER SIDE)
+# ======================
+stats = {
+    "batches": 0,
+    "events": 0,
+    "duplicates": 0,
+    "failed": 0,
+    "busy_seconds": 0.0
+}
+
+def claim_batch(limit=BATCH_SIZE):
+    return claim_rows(
+        MessengerEvent,
+        MessengerEvent.status == "pending",
+        "processing",
+        CLAIM_TIMEOUT,
+        limit
+    )
+
+class BatchContext:
+    # Everything a batch touches is loaded up front in a few IN (...)
+    # queries instead of one lookup per event.
+    def __init__(self, rows):
+        psids = {r.psid for r in rows}
+        self.links = {
+            l.psid: l
+            for l in MessengerLink.query.filter(MessengerLink.psid.in_(psids))
+        }
+
+        user_ids = {l.user_id for l in self.links.values() if l.user_id}
+        self.users = {
+            u.id: u
+            for u in User.query.filter(User.id.in_(user_ids))
+        } if user_ids else {}
+
+        self.task_logs = {
+            log.user_id: log
+            for log in TaskLog.query.filter(
+                TaskLog.user_id.in_(user_ids),
+                TaskLog.platform == "messenger"
+            )
+        } if user_ids else {}
+
+        self.replies = []
+
+    def reply(self, psid, text):
+        self.replies.append((psid, text))
+
+    def discard_unsaved(self, replies_before):
+        # after an event's savepoint rolled back: drop the replies it queued
+        # and any link / task log it created, which no longer exist
+        del self.replies[replies_before:]
+        for cache in (self.links, self.task_logs):
+            for key, obj in list(cache.items()):
+                if not inspect(obj).persistent:
+                    del cache[key]
+
+def handle_event(row, ctx):
+    event = json.loads(row.payload)
+    psid = row.psid
+
+    # queued before receipts were filtered out at ingestion
+    if not _is_actionable(event):
+        return
+
+    text = (
+        event.get("message", {}).get("text")
+        or event.get("postback", {}).get("payload")
+        or ""
+    ).strip().lower()
+
+    link = ctx.links.get(psid)
+    if link is None:
+        link = MessengerLink(psid=psid)
+        db.session.add(link)
+        ctx.links[psid] = link
+
+    user = ctx.users.get(link.user_id)
+    if not link.active or not user:
+        ctx.reply(psid, (
+            f"👋 Welcome to iFund!\n"
+            f"Your Messenger Activation ID is IFD-{psid}\n"
+            f"Enter it on the website under Activate Messenger."
+        ))
+        return
+
+    # =========================
+    # ANSWER TO A PENDING TASK
+    # =========================
+    if link.pending_answer is not None and text.isdigit():
+        if int(text) == int(link.pending_answer):
+            earned = random.randint(1, 2)
+            # committed with the batch (so a crash never rewards twice), but
+            # as col = col + n so it can't overwrite a points buffer flush
+            db.session.execute(
+                db.update(User)
+                .where(User.id == user.id)
+                .values(points=User.points + earned)
+            )
+            record_activity("task_completed", user.id, earned)
+            ctx.reply(psid, f"✅ Correct! +{earned} points 🎉")
+        else:
+            ctx.reply(psid, "❌ Wrong answer. Reply TASK for another one.")
+
+        link.pending_answer = None
+        return
+
+    # =========================
+    # NEW TASK (WITH COOLDOWN)
+    # =========================
+    if text in ("task", "math"):
+        now = datetime.utcnow()
+        log = ctx.task_logs.get(user.id)
+
+        if log and log.last_task_at:
+            remaining = COOLDOWN - int((now - log.last_task_at).total_seconds())
+            if remaining > 0:
+                ctx.reply(psid, f"⏳ Please wait {remaining}s before the next task.")
+                return
+
+        if not log:
+            log = TaskLog(user_id=user.id, platform="messenger")
+            db.session.add(log)
+            ctx.task_logs[user.id] = log
+        log.last_task_at = now
+
+        question, answer = generate_hard_task()
+        link.pending_answer = str(answer)
+        ctx.reply(psid, f"🧠 {question}\n\nReply with the number.")
+        return
+
+    ctx.reply(psid, dashboard_text(user))
+
+def process_batch(rows):
+    started = time.monotonic()
+    ctx = BatchContext(rows)
+
+    # =========================
+    # DEDUPLICATE BY MESSAGE ID
+    # =========================
+    # Facebook retries deliveries it thinks timed out, so the same mid can
+    # show up twice in one batch or after it was already handled.
+    mids = {r.mid for r in rows if r.mid}
+    seen = set()
+    if mids:
+        seen = {
+            mid for (mid,) in db.session.query(MessengerEvent.mid).filter(
+                MessengerEvent.mid.in_(mids),
+                MessengerEvent.status == "done"
+            )
+        }
+
+    now = datetime.utcnow()
+    done = duplicates = failed = 0
+
+    for row in rows:
+        row.processed_at = now
+
+        if row.mid and row.mid in seen:
+            row.status = "duplicate"
+            duplicates += 1
+            continue
+        if row.mid:
+            seen.add(row.mid)
+
+        # each event in its own savepoint: one that fails (a bad payload,
+        # a link another worker created for the same PSID first) leaves no
+        # partial changes and doesn't take the rest of the batch with it
+        replies_before = len(ctx.replies)
+        try:
+            with db.session.begin_nested():
+                handle_event(row, ctx)
+        except Exception as e:
+            first_line = (str(e).splitlines() or [""])[0]
+            print(f"[messenger] event {row.id} failed: {type(e).__name__}: {first_line}")
+            ctx.discard_unsaved(replies_before)
+            row.status = "failed"
+            failed += 1
+            continue
+
+        row.status = "done"
+        done += 1
+
+    db.session.commit()
+
+    # replies go out after the commit so a crash never rewards twice
+    for psid, text in ctx.replies:
+        try:
+            send_message(psid, text)
+        except requests.RequestException as e:
+            print(f"[messenger] send to {psid} failed: {e}")
+
+    elapsed = time.monotonic() - started
+
+    stats["batches"] += 1
+    stats["events"] += done
+    stats["duplicates"] += duplicates
+    stats["failed"] += failed
+    stats["busy_seconds"] += elapsed
+
+    oldest = min(r.received_at for r in rows)
+    rate = len(rows) / elapsed if elapsed else 0
+    avg_rate = stats["events"] / stats["busy_seconds"]
+    print(
+        f"[messenger] batch={len(rows)} done={done} dup={duplicates} "
+        f"failed={failed} {rate:.0f} ev/s "
+        f"lag={(now - oldest).total_seconds():.1f}s "
+        f"total={stats['events']} avg={avg_rate:.0f} ev/s"
+    )
+
+def run_worker(once=False):
+    while True:
+        rows = []
+        try:
+            rows = claim_batch()
+            if rows:
+                process_batch(rows)
+        except Exception as e:
+            # the batch is reclaimed after CLAIM_TIMEOUT; keep serving others
+            db.session.rollback()
+            print(f"[messenger] batch failed: {type(e).__name__}: {e}")
+            if once:
+                raise
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        if once:
+            return
+
+        if len(rows) < BATCH_SIZE:
+            time.sleep(POLL_INTERVAL)
@@ -0,0 +1,10 @@
+import sys
+
+from app import app
+from messenger_bot import run_worker
+
+
+if __name__ == "__main__":
+    print("=== MESSENGER EVENT WORKER ===")
+    with app.app_context():
+        run_worker(once="--once" in sys.argv)
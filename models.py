@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
-db = SQLAlchemy()
+from replica import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class ActivationCode(db.Model):
     __tablename__ = "activation_codes"
@@ -33,6 +35,9 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
 
 class Withdrawal(db.Model):
+    # archived rows keep their ids, so SQLite must never reuse one
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(20))
     amount = db.Column(db.Float)
@@ -43,6 +48,43 @@ class Withdrawal(db.Model):
     processed_at = db.Column(db.DateTime)
     notify_email = db.Column(db.String(120), nullable=True)
 
+# Per-user history lookups walk this index newest-first. Created explicitly
+# at startup because create_all() skips indexes on tables that exist.
+withdrawal_user_index = db.Index(
+    "ix_withdrawal_user_requested",
+    Withdrawal.user_id,
+    Withdrawal.requested_at.desc(),
+    Withdrawal.id.desc()
+)
+
+class WithdrawalTotals(db.Model):
+    __tablename__ = "withdrawal_totals"
+
+    # running per-user counters, bumped with each withdrawal status change
+    user_id = db.Column(db.String(20), primary_key=True)  # users.user_id
+    pending_count = db.Column(db.Integer, default=0)
+    pending_amount = db.Column(db.Float, default=0)
+    approved_count = db.Column(db.Integer, default=0)
+    approved_amount = db.Column(db.Float, default=0)
+    rejected_count = db.Column(db.Integer, default=0)
+    rejected_amount = db.Column(db.Float, default=0)
+
+class BalanceTransaction(db.Model):
+    __tablename__ = "balance_transactions"
+    __table_args__ = (
+        db.Index("ix_balance_transactions_user", "user_id", "id"),
+    )
+
+    # append-only: every change to users.cash_balance, signed
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(20), nullable=False)  # users.user_id
+    amount = db.Column(db.Float, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    # opening / referral_bonus / conversion / withdrawal / withdrawal_refund
+    ref_id = db.Column(db.Integer)  # withdrawals.id for withdrawal kinds
+    # database clock, like Withdrawal.requested_at, so both agree
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
 class AdminFund(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
@@ -64,8 +106,144 @@ class Task(db.Model):
 
 class TaskLog(db.Model):
     __tablename__ = "task_logs"
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer)
     platform = db.Column(db.String(20))  # web / messenger
     last_task_at = db.Column(db.DateTime)
+
+class NotificationOutbox(db.Model):
+    __tablename__ = "notification_outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    withdrawal_id = db.Column(db.Integer, index=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    status = db.Column(db.String(20), default="pending", index=True)
+    # pending / sending / sent / failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+class MessengerLink(db.Model):
+    __tablename__ = "messenger_links"
+
+    id = db.Column(db.Integer, primary_key=True)
+    psid = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, index=True)  # users.id once activated
+    active = db.Column(db.Boolean, default=False)
+
+    # math task waiting for an answer in chat
+    pending_answer = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class MessengerEvent(db.Model):
+    __tablename__ = "messenger_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    mid = db.Column(db.String(200), index=True)  # Facebook message id
+    psid = db.Column(db.String(64))
+    payload = db.Column(db.Text, nullable=False)  # raw messaging event JSON
+
+    status = db.Column(db.String(20), default="pending", index=True)
+    # pending / processing / done / duplicate / failed
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+class ActivityEvent(db.Model):
+    __tablename__ = "activity_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    # task_completed / conversion / signup / withdrawal_requested /
+    # withdrawal_approved / withdrawal_rejected
+    user_id = db.Column(db.Integer)  # users.id when known
+    amount = db.Column(db.Float, default=0)  # points or pesos, per kind
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ActivityRollup(db.Model):
+    __tablename__ = "activity_rollups"
+    __table_args__ = (
+        db.UniqueConstraint("granularity", "bucket", "kind"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # hour / day
+    bucket = db.Column(db.DateTime, nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    count = db.Column(db.Integer, default=0)
+    total = db.Column(db.Float, default=0)
+
+class RollupState(db.Model):
+    __tablename__ = "rollup_state"
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_event_id = db.Column(db.Integer, default=0)
+
+# ======================
+# ARCHIVE TABLES
+# ======================
+# Processed withdrawals and stale task logs are moved here by
+# archive_records.py. On Postgres both are range-partitioned by month, which
+# is why the partition column is part of the primary key.
+class WithdrawalArchive(db.Model):
+    __tablename__ = "withdrawal_archive"
+    __table_args__ = (
+        db.Index("ix_withdrawal_archive_user", "user_id", "requested_at"),
+        {"postgresql_partition_by": "RANGE (requested_at)"},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    requested_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.String(20))
+    amount = db.Column(db.Float)
+    method = db.Column(db.String(20))
+    account_info = db.Column(db.String(100))
+    status = db.Column(db.String(20))
+    processed_at = db.Column(db.DateTime)
+    notify_email = db.Column(db.String(120), nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TaskLogArchive(db.Model):
+    __tablename__ = "task_log_archive"
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (last_task_at)"},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_task_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer)
+    platform = db.Column(db.String(20))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SessionRecord(db.Model):
+    __tablename__ = "server_sessions"
+
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class Referral(db.Model):
+    __tablename__ = "referrals"
+
+    id = db.Column(db.Integer, primary_key=True)
+    referrer_id = db.Column(db.String(20), index=True)  # users.user_id
+    referred_id = db.Column(db.String(20), unique=True)  # users.user_id
+    signup_ip = db.Column(db.String(45))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AbuseFlag(db.Model):
+    __tablename__ = "abuse_flags"
+
+    user_id = db.Column(db.String(20), primary_key=True)  # users.user_id
+    score = db.Column(db.Float, nullable=False)
+    reasons = db.Column(db.String(200))
+    scanned_at = db.Column(db.DateTime, default=datetime.utcnow)
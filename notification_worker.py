@@ -0,0 +1,10 @@
+import sys
+
+from app import app
+from notifications import run_worker
+
+
+if __name__ == "__main__":
+    print("=== WITHDRAWAL NOTIFICATION WORKER ===")
+    with app.app_context():
+        run_worker(once="--once" in sys.argv)
@@ -0,0 +1,212 @@
+import os
+import re
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from models import db, NotificationOutbox
+from work_queue import claim_rows
+
+# ======================
+# CONFIG
+# ======================
+# Point SMTP_HOST / SMTP_PORT at a local stand-in while testing, e.g.
+#   python -m aiosmtpd -n -l localhost:1025
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "1025"))
+SMTP_USER = os.environ.get("SMTP_USER")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "0") == "1"
+SMTP_TIMEOUT = 10
+MAIL_FROM = os.environ.get("MAIL_FROM", "iFund Marketing <no-reply@ifund.local>")
+
+BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", "50"))
+POLL_INTERVAL = float(os.environ.get("NOTIFY_POLL_INTERVAL", "5"))
+MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE = 30          # seconds, doubled per attempt
+CLAIM_TIMEOUT = 300        # reclaim rows stuck in "sending" after a crash
+
+# one plain address: no display name, no whitespace or header line breaks
+EMAIL_PATTERN = re.compile(r"^[^@\s<>,;]+@[^@\s<>,;]+\.[^@\s<>,;]+$")
+
+# ======================
+# OUTBOX (WEB SIDE)
+# ======================
+def valid_email(address):
+    return bool(address) and len(address) <= 120 and bool(EMAIL_PATTERN.match(address))
+
+# Only adds to the session: the caller's commit makes the withdrawal
+# status change and its notification durable together. Rows stored before
+# addresses were validated are skipped rather than queued.
+def queue_withdrawal_notification(w):
+    if not valid_email(w.notify_email):
+        return None
+
+    if w.status == "approved":
+        subject = "Your iFund withdrawal was approved"
+        body = (
+            f"Good news! Your withdrawal of ₱{w.amount:.2f} via {w.method} "
+            f"has been approved and is on its way to {w.account_info}."
+        )
+    else:
+        subject = "Your iFund withdrawal was rejected"
+        body = (
+            f"Your withdrawal of ₱{w.amount:.2f} via {w.method} was rejected. "
+            f"The amount has been returned to your iFund balance."
+        )
+
+    msg = NotificationOutbox(
+        withdrawal_id=w.id,
+        recipient=w.notify_email,
+        subject=subject,
+        body=body
+    )
+    db.session.add(msg)
+    return msg
+
+# ======================
+# SMTP CONNECTION
+# ======================
+# One long-lived SMTP connection reused across batches
+class SMTPConnection:
+    def __init__(self):
+        self.conn = None
+
+    def _connect(self):
+        conn = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            conn.starttls()
+        if SMTP_USER:
+            conn.login(SMTP_USER, SMTP_PASSWORD or "")
+        self.conn = conn
+
+    def _alive(self):
+        if self.conn is None:
+            return False
+        try:
+            return self.conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg):
+        if not self._alive():
+            self.close()
+            self._connect()
+
+        try:
+            self.conn.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # server dropped an idle connection, retry once on a fresh one
+            self.close()
+            self._connect()
+            self.conn.send_message(msg)
+
+    def close(self):
+        if self.conn is None:
+            return
+        try:
+            self.conn.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.conn = None
+
+def build_message(row):
+    msg = EmailMessage()
+    msg["From"] = MAIL_FROM
+    msg["To"] = row.recipient
+    msg["Subject"] = row.subject
+    msg.set_content(row.body)
+    return msg
+
+# ======================
+# WORKER SIDE
+# ======================
+def claim_batch(limit=BATCH_SIZE):
+    return claim_rows(
+        NotificationOutbox,
+        db.and_(
+            NotificationOutbox.status == "pending",
+            NotificationOutbox.next_attempt_at <= datetime.utcnow()
+        ),
+        "sending",
+        CLAIM_TIMEOUT,
+        limit
+    )
+
+def failure_values(attempts, error, retry):
+    attempts += 1
+    values = {
+        "attempts": attempts,
+        "last_error": f"{type(error).__name__}: {error}"[:500]
+    }
+
+    if not retry or attempts >= MAX_ATTEMPTS:
+        values["status"] = "failed"
+    else:
+        delay = BACKOFF_BASE * (2 ** (attempts - 1))
+        values["status"] = "pending"
+        values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=delay)
+    return values
+
+# Each row's outcome is committed right after its send, so a crash later in
+# the batch never makes an already delivered message go out again. A row
+# that can't be turned into a message fails alone instead of taking the
+# worker (and, once reclaimed, every restart) down with it. Messages are
+# built before the first commit, which expires the loaded rows.
+def send_batch(smtp, rows):
+    sent = 0
+    jobs = []
+
+    for row in rows:
+        try:
+            jobs.append((row.id, row.attempts or 0, build_message(row), None))
+        except Exception as e:
+            jobs.append((row.id, row.attempts or 0, None, e))
+
+    for row_id, attempts, msg, error in jobs:
+        if error is not None:
+            values = failure_values(attempts, error, retry=False)
+        else:
+            try:
+                smtp.send(msg)
+            except Exception as e:
+                values = failure_values(attempts, e, retry=True)
+            else:
+                values = {
+                    "status": "sent",
+                    "sent_at": datetime.utcnow(),
+                    "last_error": None
+                }
+                sent += 1
+
+        db.session.execute(
+            db.update(NotificationOutbox)
+            .where(NotificationOutbox.id == row_id)
+            .values(**values),
+            execution_options={"synchronize_session": False}
+        )
+        db.session.commit()
+
+    return sent
+
+def run_worker(once=False):
+    smtp = SMTPConnection()
+
+    try:
+        while True:
+            rows = claim_batch()
+
+            if rows:
+                sent = send_batch(smtp, rows)
+                print(f"[notify] sent {sent}/{len(rows)}")
+
+            if once:
+                return
+
+            # keep draining while there is a backlog, otherwise idle
+            if len(rows) < BATCH_SIZE:
+                smtp.close()
+                time.sleep(POLL_INTERVAL)
+    finally:
+        smtp.close()
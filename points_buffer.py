@@ -0,0 +1,351 @@
+import atexit
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+from models import db, User
+
+try:
+    import redis
+except ImportError:  # only needed for POINTS_BUFFER=redis
+    redis = None
+
+# Rows per UPDATE statement
+FLUSH_CHUNK = 500
+# One flush runs at a time, across workers with the Redis store. A flusher
+# that dies keeps the lock until it expires; a caller waits this long.
+FLUSH_LOCK_SECONDS = 30
+FLUSH_WAIT_SECONDS = 10
+
+# session.info key for rewards waiting on the caller's commit
+SESSION_KEY = "points_rewards"
+
+class PointsBusy(Exception):
+    pass
+
+# ======================
+# STORES
+# ======================
+# A store holds pending point deltas per users.id. Under flush_lock(),
+# take_all() and take() move what they return to an in-flight set that
+# still counts in get(); done() drops it once the flush has committed and
+# put_back() returns it to pending after a failed one.
+
+class MemoryStore:
+    # Per-process: with several workers a user's pending points are spread
+    # over them, so /convert only sees its own worker's share. Use the Redis
+    # store to share one buffer across workers.
+    def __init__(self):
+        self.pending = Counter()
+        self.in_flight = Counter()
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+
+    @contextmanager
+    def flush_lock(self):
+        if not self.flushing.acquire(timeout=FLUSH_WAIT_SECONDS):
+            raise PointsBusy("another flush is still running")
+        try:
+            yield
+        finally:
+            self.flushing.release()
+
+    def add(self, user_id, points):
+        with self.lock:
+            self.pending[user_id] += points
+
+    def get(self, user_id):
+        with self.lock:
+            return self.pending.get(user_id, 0) + self.in_flight.get(user_id, 0)
+
+    def take(self, user_id):
+        with self.lock:
+            points = self.pending.pop(user_id, 0)
+            self.in_flight = Counter({user_id: points})
+        return points
+
+    def take_all(self):
+        with self.lock:
+            self.in_flight, self.pending = self.pending, Counter()
+            return dict(self.in_flight)
+
+    def done(self):
+        with self.lock:
+            self.in_flight = Counter()
+
+    def put_back(self):
+        with self.lock:
+            self.pending.update(self.in_flight)
+            self.in_flight = Counter()
+
+# Each script first drops an in-flight hash left by a flusher that died
+# holding the lock: whether it committed is unknown, and counting it again
+# could pay the points twice.
+
+TAKE_LUA = """
+redis.call("DEL", KEYS[2])
+local v = redis.call("HGET", KEYS[1], ARGV[1])
+if v then
+    redis.call("HDEL", KEYS[1], ARGV[1])
+    redis.call("HSET", KEYS[2], ARGV[1], v)
+    redis.call("PEXPIRE", KEYS[2], ARGV[2])
+end
+return v
+"""
+
+TAKE_ALL_LUA = """
+redis.call("DEL", KEYS[2])
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return {}
+end
+redis.call("RENAME", KEYS[1], KEYS[2])
+redis.call("PEXPIRE", KEYS[2], ARGV[1])
+return redis.call("HGETALL", KEYS[2])
+"""
+
+PUT_BACK_LUA = """
+local v = redis.call("HGETALL", KEYS[2])
+for i = 1, #v, 2 do
+    redis.call("HINCRBY", KEYS[1], v[i], v[i + 1])
+end
+redis.call("DEL", KEYS[2])
+"""
+
+class RedisStore:
+    # One hash shared by every worker; pending points survive a worker
+    # crash and a flush from any worker applies all of them. The flush lock
+    # is a Redis lock too, so flush_user() in one worker waits for a flush
+    # in another that already took the user's points.
+    KEY = "points:pending"
+    IN_FLIGHT_KEY = "points:in_flight"
+    LOCK_KEY = "points:flush_lock"
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("POINTS_BUFFER=redis needs the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.keys = [self.KEY, self.IN_FLIGHT_KEY]
+        self.take_script = self.client.register_script(TAKE_LUA)
+        self.take_all_script = self.client.register_script(TAKE_ALL_LUA)
+        self.put_back_script = self.client.register_script(PUT_BACK_LUA)
+
+    @contextmanager
+    def flush_lock(self):
+        lock = self.client.lock(self.LOCK_KEY, timeout=FLUSH_LOCK_SECONDS,
+                                blocking_timeout=FLUSH_WAIT_SECONDS)
+        if not lock.acquire():
+            raise PointsBusy("another flush is still running")
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                print("[points] flush outlived its lock")
+
+    def add(self, user_id, points):
+        self.client.hincrby(self.KEY, user_id, points)
+
+    def get(self, user_id):
+        pipe = self.client.pipeline()
+        pipe.hget(self.KEY, user_id)
+        pipe.hget(self.IN_FLIGHT_KEY, user_id)
+        return sum(int(v or 0) for v in pipe.execute())
+
+    def take(self, user_id):
+        ttl = FLUSH_LOCK_SECONDS * 1000
+        return int(self.take_script(keys=self.keys, args=[user_id, ttl]) or 0)
+
+    def take_all(self):
+        flat = self.take_all_script(keys=self.keys, args=[FLUSH_LOCK_SECONDS * 1000])
+        return {int(k): int(v) for k, v in zip(flat[::2], flat[1::2])}
+
+    def done(self):
+        self.client.delete(self.IN_FLIGHT_KEY)
+
+    def put_back(self):
+        self.put_back_script(keys=self.keys)
+
+# ======================
+# ACCUMULATOR
+# ======================
+# Task rewards only ever add points, so instead of one read-modify-write
+# and commit per correct answer they are summed per user and written in
+# batches, every `interval` seconds or after `max_events` rewards, whichever
+# comes first. A reward joins the buffer only once the caller's session
+# commits. Anything that needs the exact balance (converting points) calls
+# flush_user() first; views show stored + pending().
+class PointsBuffer:
+    def __init__(self):
+        self.app = None
+        self.store = None
+        self.interval = 0
+        self.max_events = 0
+        self.events = 0
+        self.wake = threading.Event()
+        self.thread = None
+
+    def init_app(self, app, backend="memory", redis_url=None,
+                 interval=5, max_events=500, workers=1):
+        self.app = app
+        self.interval = interval
+        self.max_events = max_events
+
+        # Spread over several processes, /convert would only see its own
+        # worker's share and the shown points would depend on which worker
+        # answered, so a per-process buffer is only used with one worker.
+        if backend == "memory" and workers > 1:
+            print(f"[points] {workers} workers share no memory; "
+                  f"use POINTS_BUFFER=redis to buffer, writing through for now")
+            backend = "off"
+
+        if backend == "off":
+            self.store = None
+            return
+        if backend == "redis":
+            self.store = RedisStore(redis_url or "redis://localhost:6379/0")
+        else:
+            self.store = MemoryStore()
+
+        # gunicorn exits its workers through sys.exit, which runs atexit.
+        # A plain `python app.py` dies on SIGTERM without it, so turn that
+        # into a normal exit too (but never replace a server's own handler).
+        atexit.register(self.shutdown)
+        if (threading.current_thread() is threading.main_thread()
+                and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL):
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # ---------- writes ----------
+    def add(self, user_id, points):
+        if self.store is None:
+            # unbuffered: same transaction as the caller, still col = col + n
+            db.session.execute(
+                db.update(User)
+                .where(User.id == user_id)
+                .values(points=User.points + points)
+            )
+            return
+
+        # held on the session, so a rolled back answer never pays out
+        db.session.info.setdefault(SESSION_KEY, []).append((user_id, points))
+
+    def add_committed(self, rewards):
+        for user_id, points in rewards:
+            self.store.add(user_id, points)
+        self.events += len(rewards)
+        self.ensure_thread()
+        if self.events >= self.max_events:
+            self.wake.set()
+
+    def pending(self, user_id):
+        if self.store is None:
+            return 0
+        return self.store.get(user_id)
+
+    # The lock makes flush_user() wait for a flush that already took this
+    # user's points but has not committed them yet. Raises PointsBusy if
+    # that flush takes longer than FLUSH_WAIT_SECONDS.
+    def flush_user(self, user_id):
+        if self.store is None:
+            return
+        with self.store.flush_lock():
+            points = self.store.take(user_id)
+            if points:
+                self.write({user_id: points})
+
+    def flush(self):
+        if self.store is None:
+            return 0
+        with self.store.flush_lock():
+            self.events = 0
+            deltas = {uid: n for uid, n in self.store.take_all().items() if n}
+            if deltas:
+                self.write(deltas)
+        return len(deltas)
+
+    def write(self, deltas):
+        # own connection and transaction, so a flush never commits (or rolls
+        # back) whatever the caller's session has in progress
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    apply_deltas(conn, deltas)
+        except Exception:
+            self.store.put_back()
+            raise
+        self.store.done()
+
+    # ---------- flush thread ----------
+    def ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+            self.thread.start()
+
+    def flush_loop(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[points] flush failed, will retry: {e}")
+                time.sleep(self.interval)
+
+    def shutdown(self):
+        try:
+            flushed = self.flush()
+        except Exception as e:
+            print(f"[points] final flush failed: {e}")
+            return
+        if flushed:
+            print(f"[points] flushed pending points for {flushed} users on exit")
+
+def apply_deltas(conn, deltas):
+    # sorted by id so concurrent flushers lock rows in the same order
+    items = sorted(deltas.items())
+
+    if conn.dialect.name != "postgresql":
+        conn.execute(
+            text("UPDATE users SET points = points + :delta WHERE id = :id"),
+            [{"id": uid, "delta": points} for uid, points in items]
+        )
+        return
+
+    for i in range(0, len(items), FLUSH_CHUNK):
+        chunk = items[i:i + FLUSH_CHUNK]
+        values = ", ".join(
+            f"(CAST(:id{n} AS INTEGER), CAST(:delta{n} AS INTEGER))"
+            for n in range(len(chunk))
+        )
+        params = {}
+        for n, (uid, points) in enumerate(chunk):
+            params[f"id{n}"] = uid
+            params[f"delta{n}"] = points
+
+        conn.execute(
+            text(
+                "UPDATE users SET points = users.points + v.delta "
+                f"FROM (VALUES {values}) AS v(id, delta) "
+                "WHERE users.id = v.id"
+            ),
+            params
+        )
+
+points_buffer = PointsBuffer()
+
+@event.listens_for(db.session, "after_commit")
+def _buffer_rewards(db_session):
+    rewards = db_session.info.pop(SESSION_KEY, None)
+    if rewards:
+        points_buffer.add_committed(rewards)
+
+@event.listens_for(db.session, "after_transaction_end")
+def _drop_rewards(db_session, transaction):
+    # after_commit has already taken them if the transaction committed
+    if transaction.parent is None:
+        db_session.info.pop(SESSION_KEY, None)
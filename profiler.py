@@ -0,0 +1,187 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MAX_DEPTH = 64
+RECENT_REQUESTS = 50
+
+# ======================
+# SAMPLING PROFILER
+# ======================
+# A background thread wakes every `interval` seconds and records the
+# current stack of each request thread that was picked for sampling, so a
+# sampled request pays almost nothing and an unsampled one pays a single
+# attribute check. Everything is kept in memory per worker process, so
+# the profiler can only be switched on when there is a single worker: with
+# several, the admin page would change and show whichever one answered.
+class SamplingProfiler:
+    def __init__(self, app, workers=1):
+        self.available = workers <= 1
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.route = None
+        self.user_id = None
+        self.interval = 0.005
+
+        self.lock = threading.Lock()
+        self.active = {}                       # thread id -> request info
+        self.stacks = defaultdict(Counter)     # endpoint -> collapsed stacks
+        self.sql = defaultdict(Counter)        # endpoint -> statement counts
+        self.sql_time = defaultdict(Counter)   # endpoint -> statement seconds
+        self.requests = Counter()              # endpoint -> sampled requests
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+        self.thread = None
+
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+        event.listen(Engine, "before_cursor_execute", self.before_cursor)
+        event.listen(Engine, "after_cursor_execute", self.after_cursor)
+
+    # ---------- configuration ----------
+    def configure(self, enabled, sample_rate, route=None, user_id=None):
+        if enabled and not self.available:
+            return False
+
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.route = route or None
+        self.user_id = user_id
+        self.enabled = enabled
+
+        if enabled and (self.thread is None or not self.thread.is_alive()):
+            self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+            self.thread.start()
+        return True
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.sql.clear()
+            self.sql_time.clear()
+            self.requests.clear()
+            self.recent.clear()
+
+    # ---------- request hooks ----------
+    def wants(self):
+        if self.route:
+            return request.endpoint == self.route
+        if self.user_id is not None:
+            return session.get("user") == self.user_id
+        return random.random() < self.sample_rate
+
+    def before_request(self):
+        if not self.enabled or not self.wants():
+            return
+
+        g.profile = {
+            "endpoint": request.endpoint or request.path,
+            "path": request.path,
+            "user": session.get("user"),
+            "started": time.perf_counter(),
+            "samples": 0,
+            "sql": []
+        }
+        self.active[threading.get_ident()] = g.profile
+
+    def teardown_request(self, exc):
+        info = g.pop("profile", None)
+        if info is None:
+            return
+
+        self.active.pop(threading.get_ident(), None)
+        info["duration"] = time.perf_counter() - info["started"]
+
+        with self.lock:
+            self.requests[info["endpoint"]] += 1
+            self.recent.appendleft(info)
+
+    # ---------- SQL ----------
+    def before_cursor(self, conn, cursor, statement, params, context, executemany):
+        if self.enabled and has_request_context() and "profile" in g:
+            conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    def after_cursor(self, conn, cursor, statement, params, context, executemany):
+        if not (self.enabled and has_request_context() and "profile" in g):
+            return
+
+        started = conn.info.get("profile_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+
+        stmt = re.sub(r"\s+", " ", statement).strip()[:300]
+        endpoint = g.profile["endpoint"]
+        g.profile["sql"].append((stmt, elapsed))
+
+        with self.lock:
+            self.sql[endpoint][stmt] += 1
+            self.sql_time[endpoint][stmt] += elapsed
+
+    # ---------- sampler thread ----------
+    def sample_loop(self):
+        while self.enabled:
+            if self.active:
+                frames = sys._current_frames()
+                for tid, info in list(self.active.items()):
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        self.record(info, frame)
+            time.sleep(self.interval)
+
+    def record(self, info, frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                f":{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+
+        stack = ";".join(reversed(names))
+        info["samples"] += 1
+
+        with self.lock:
+            self.stacks[info["endpoint"]][stack] += 1
+
+    # ---------- reports ----------
+    # One "frame;frame;frame count" line per stack, the format read by
+    # flamegraph.pl, speedscope and inferno.
+    def collapsed(self, endpoint=None):
+        with self.lock:
+            if endpoint:
+                items = self.stacks.get(endpoint, Counter()).items()
+            else:
+                merged = Counter()
+                for stacks in self.stacks.values():
+                    merged.update(stacks)
+                items = merged.items()
+
+            return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def summary(self):
+        with self.lock:
+            routes = []
+            for endpoint, count in self.requests.most_common():
+                top_sql = sorted(
+                    self.sql_time[endpoint].items(),
+                    key=lambda item: item[1],
+                    reverse=True
+                )[:5]
+                routes.append({
+                    "endpoint": endpoint,
+                    "requests": count,
+                    "samples": sum(self.stacks[endpoint].values()),
+                    "sql": [
+                        (stmt, self.sql[endpoint][stmt], seconds)
+                        for stmt, seconds in top_sql
+                    ]
+                })
+            return routes, list(self.recent)
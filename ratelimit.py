@@ -0,0 +1,232 @@
+import threading
+import time
+import uuid
+
+from flask import g, jsonify, make_response, request, session
+
+try:
+    import redis
+except ImportError:  # only needed for RATE_LIMIT_BACKEND=redis
+    redis = None
+
+# ======================
+# RULES
+# ======================
+# A rule allows `capacity` requests per `per` seconds for one key, refilled
+# continuously (token bucket). scope is "ip", "username" (from the login or
+# signup form) or "user" (the logged-in user id).
+class Rule:
+    def __init__(self, scope, capacity, per, methods=("POST",)):
+        self.scope = scope
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.methods = methods
+
+# ======================
+# BACKENDS
+# ======================
+class MemoryBackend:
+    # Per-process buckets and in-flight count. Fine for one gunicorn worker
+    # or a threaded worker; use the Redis backend to share across workers.
+    MAX_KEYS = 100000
+    # a sync worker never has more than one request in flight, so an
+    # in-process count can't drive load shedding
+    shared = False
+
+    def __init__(self):
+        self.buckets = {}
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, last = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                allowed = True
+            else:
+                self.buckets[key] = (tokens, now)
+                allowed = False
+
+            if len(self.buckets) > self.MAX_KEYS:
+                self._prune(now)
+
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def _prune(self, now):
+        # buckets idle for 10 minutes are full again, so forgetting them is safe
+        stale = [k for k, (_, last) in self.buckets.items() if now - last > 600]
+        for k in stale:
+            del self.buckets[k]
+
+    def enter(self):
+        with self.lock:
+            self.inflight += 1
+            return self.inflight, None
+
+    def leave(self, ticket):
+        with self.lock:
+            self.inflight -= 1
+
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+local data = redis.call("HMGET", KEYS[1], "t", "ts")
+local tokens = tonumber(data[1]) or capacity
+local last = tonumber(data[2]) or now
+
+tokens = math.min(capacity, tokens + (now - last) * rate)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+
+redis.call("HSET", KEYS[1], "t", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+class RedisBackend:
+    # Shared by every worker. In-flight requests are kept in a sorted set
+    # scored by start time, so entries leaked by a killed worker age out.
+    INFLIGHT_KEY = "ratelimit:inflight"
+    INFLIGHT_TTL = 60
+    shared = True
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, key, capacity, rate):
+        allowed, tokens = self.script(
+            keys=["ratelimit:" + key],
+            args=[capacity, rate, time.time()]
+        )
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+    def enter(self):
+        ticket = uuid.uuid4().hex
+        now = time.time()
+
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.INFLIGHT_KEY, 0, now - self.INFLIGHT_TTL)
+        pipe.zadd(self.INFLIGHT_KEY, {ticket: now})
+        pipe.zcard(self.INFLIGHT_KEY)
+        count = pipe.execute()[-1]
+        return count, ticket
+
+    def leave(self, ticket):
+        self.client.zrem(self.INFLIGHT_KEY, ticket)
+
+# ======================
+# MIDDLEWARE
+# ======================
+class RateLimiter:
+    # Runs before every other hook: a rejected request never parses
+    # anything heavier than the form, never hashes a password and never
+    # calls reCAPTCHA. Only "user" rules have to open the session.
+    def __init__(self, app, backend, rules, priorities, shed_threshold):
+        self.backend = backend
+        self.rules = rules
+        self.priorities = priorities
+
+        if shed_threshold and not backend.shared:
+            print("[ratelimit] SHED_INFLIGHT needs RATE_LIMIT_BACKEND=redis; "
+                  "load shedding is off")
+            shed_threshold = 0
+        self.shed_threshold = shed_threshold
+
+        hooks = app.before_request_funcs.setdefault(None, [])
+        hooks.insert(0, self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    # ---------- load shedding ----------
+    def shed(self, count):
+        priority = self.priorities.get(request.endpoint, "normal")
+        if priority == "high":
+            return False
+        if priority == "low":
+            return count > self.shed_threshold
+        return count > self.shed_threshold * 2
+
+    # ---------- token buckets ----------
+    def key_for(self, scope):
+        if scope == "ip":
+            return request.remote_addr
+        if scope == "username":
+            return (request.form.get("username") or "").strip().lower() or None
+        if scope == "user":
+            uid = session.get("user")
+            return str(uid) if uid is not None else None
+        return None
+
+    def check_rules(self):
+        # cheapest keys first; "user" needs the session
+        rules = sorted(
+            self.rules.get(request.endpoint, ()),
+            key=lambda r: r.scope == "user"
+        )
+
+        for rule in rules:
+            if request.method not in rule.methods:
+                continue
+
+            key = self.key_for(rule.scope)
+            if key is None:
+                continue
+
+            allowed, retry_after = self.backend.take(
+                f"{request.endpoint}:{rule.scope}:{key}",
+                rule.capacity,
+                rule.rate
+            )
+            if not allowed:
+                return retry_after
+
+        return None
+
+    def before_request(self):
+        # in-flight requests are only tracked when shedding is on
+        if self.shed_threshold:
+            count, g.inflight_ticket = self.backend.enter()
+            g.inflight_counted = True
+
+            if self.shed(count):
+                return self.reject(503, 5, "Server busy, please try again shortly.")
+
+        retry_after = self.check_rules()
+        if retry_after is not None:
+            return self.reject(429, retry_after, "Too many requests, slow down.")
+
+        return None
+
+    def teardown_request(self, exc):
+        if g.pop("inflight_counted", False):
+            self.backend.leave(g.pop("inflight_ticket", None))
+
+    def reject(self, status, retry_after, message):
+        if request.path.startswith("/api/"):
+            resp = jsonify({"error": "rate_limited", "message": message})
+        else:
+            resp = make_response(message)
+            resp.mimetype = "text/plain"
+
+        resp.status_code = status
+        resp.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        return resp
+
+def make_backend(backend, redis_url=None):
+    if backend == "redis":
+        return RedisBackend(redis_url or "redis://localhost:6379/0")
+    return MemoryBackend()
@@ -0,0 +1,78 @@
+import argparse
+import csv
+import os
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from ledger import init_worker, reconcile_chunk
+
+REPORT_COLUMNS = ["id", "user_id", "observed", "expected", "difference", "notes"]
+
+def chunk_ranges(lo, hi, size):
+    return [(start, min(start + size, hi + 1)) for start in range(lo, hi + 1, size)]
+
+
+# Run from cron or by hand. Checks every users.cash_balance against the sum
+# of its balance_transactions, and the ledger's withdrawal entries against
+# withdrawal history (hot + archive). Chunks of users.id run in parallel,
+# one database connection per worker process.
+#
+#   python reconcile_balances.py                  report only
+#   python reconcile_balances.py --seed-opening   first run after deploying
+#   python reconcile_balances.py --apply          also fix drifted balances
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--chunk", type=int, default=20000,
+                        help="users per chunk")
+    parser.add_argument("--report", default=None,
+                        help="CSV path (default reconcile-<timestamp>.csv)")
+    parser.add_argument("--seed-opening", action="store_true",
+                        help="give accounts from before the ledger an opening entry")
+    parser.add_argument("--apply", action="store_true",
+                        help="set drifted balances to the ledger's value")
+    args = parser.parse_args()
+
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        database_url = app.config["SQLALCHEMY_DATABASE_URI"]
+        lo, hi = db.session.query(db.func.min(User.id), db.func.max(User.id)).one()
+        db.engine.dispose()  # don't hand open connections to the workers
+
+    if lo is None:
+        print("[OK] No users")
+        raise SystemExit
+
+    started = time.monotonic()
+    report_path = args.report or f"reconcile-{datetime.utcnow():%Y%m%d-%H%M%S}.csv"
+    jobs = [
+        (start, end, args.seed_opening, args.apply)
+        for start, end in chunk_ranges(lo, hi, args.chunk)
+    ]
+    totals = {"users": 0, "seeded": 0, "mismatched": 0, "corrected": 0,
+              "unseeded": 0}
+
+    with open(report_path, "w", newline="") as f, \
+            Pool(args.workers, initializer=init_worker,
+                 initargs=(database_url,)) as pool:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_COLUMNS)
+
+        for done, (stats, rows) in enumerate(
+            pool.imap_unordered(reconcile_chunk, jobs), 1
+        ):
+            writer.writerows(rows)
+            for key, value in stats.items():
+                totals[key] += value
+            print(f"[reconcile] {done}/{len(jobs)} chunks, "
+                  f"{totals['users']} users, {totals['mismatched']} mismatched")
+
+    print(
+        f"[OK] Checked {totals['users']} users in "
+        f"{time.monotonic() - started:.1f}s: {totals['mismatched']} mismatched, "
+        f"{totals['corrected']} corrected, {totals['seeded']} opening entries, "
+        f"{totals['unseeded']} not on the ledger yet. Report: {report_path}"
+    )
@@ -0,0 +1,136 @@
+import os
+import time
+from functools import wraps
+
+from flask import current_app, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+
+# ======================
+# CONFIG
+# ======================
+# Set DATABASE_REPLICA_URL to enable. Two local databases work for testing:
+# create_all() only runs on the primary, so copy it to the replica first,
+#   cp instance/primary.db instance/replica.db
+#   DATABASE_URL=sqlite:///primary.db DATABASE_REPLICA_URL=sqlite:///replica.db
+# (the lag guard only applies to Postgres replicas). A replica query that
+# fails marks the replica unhealthy and the view is re-run on the primary.
+MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", "5"))
+LAG_CHECK_INTERVAL = 10
+# after a user writes, their reads stay on the primary this long
+STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", "10"))
+
+PRIMARY_UNTIL = "_db_primary_until"
+
+_lag = {"value": 0.0, "checked_at": 0.0}
+
+# ======================
+# LAG GUARD
+# ======================
+def _measure_lag(engine):
+    if engine.dialect.name != "postgresql":
+        return 0.0
+
+    try:
+        with engine.connect() as conn:
+            return float(conn.execute(text("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(
+                        EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()),
+                        0
+                    )
+                END
+            """)).scalar())
+    except SQLAlchemyError:
+        # unreachable replica counts as infinitely behind
+        return float("inf")
+
+def mark_replica_unhealthy():
+    # skip the replica until the next lag check
+    _lag["value"] = float("inf")
+    _lag["checked_at"] = time.monotonic()
+
+def replica_healthy(engine):
+    now = time.monotonic()
+    if now - _lag["checked_at"] > LAG_CHECK_INTERVAL:
+        _lag["value"] = _measure_lag(engine)
+        _lag["checked_at"] = now
+    return _lag["value"] <= MAX_LAG
+
+# ======================
+# ROUTING SESSION
+# ======================
+class RoutingSession(Session):
+    # Reads go to the "replica" bind only when the view opted in with
+    # @replica_read, nothing has been written in this session yet and the
+    # statement is not a write or a SELECT ... FOR UPDATE.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and self.info.get("use_replica")
+            and not self.info.get("wrote")
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+            and getattr(clause, "_for_update_arg", None) is None
+        ):
+            replica = self._db.engines.get("replica")
+            if replica is not None and replica_healthy(replica):
+                self.info["used_replica"] = True
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_written(db_session, flush_context):
+    db_session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_dml(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _stick_to_primary(db_session):
+    if not db_session.info.get("wrote") or not has_request_context():
+        return
+    if "replica" not in db_session._db.engines:
+        return
+    # only logged-in users read their own writes back; touching the session
+    # of an anonymous request (the webhook above all) would create one
+    if "user" not in session:
+        return
+
+    # read-your-writes: the next few requests from this user skip the replica
+    session[PRIMARY_UNTIL] = time.time() + STICKY_SECONDS
+
+# ======================
+# VIEW DECORATOR
+# ======================
+def replica_read(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        db_session = current_app.extensions["sqlalchemy"].session
+
+        if session.get(PRIMARY_UNTIL, 0) > time.time():
+            return f(*args, **kwargs)
+
+        db_session.info["use_replica"] = True
+        try:
+            return f(*args, **kwargs)
+        except DBAPIError as e:
+            if not db_session.info.get("used_replica"):
+                raise
+            # down, or missing the schema: fall back to the primary
+            print(f"[replica] query failed, using primary: {type(e).__name__}")
+            mark_replica_unhealthy()
+        finally:
+            db_session.info.pop("use_replica", None)
+            db_session.info.pop("used_replica", None)
+
+        db_session.rollback()
+        return f(*args, **kwargs)
+    return decorated
@@ -0,0 +1,10 @@
+from app import app
+from activity import rollup_activity
+
+
+# Run from cron (e.g. every 5 minutes) to fold new activity events into
+# the hourly / daily rollup tables.
+if __name__ == "__main__":
+    with app.app_context():
+        folded = rollup_activity()
+    print(f"[OK] Folded {folded} activity events")
@@ -0,0 +1,328 @@
+import math
+import os
+import random
+import time
+from datetime import datetime
+
+import requests
+from flask import session
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Withdrawal, WithdrawalTotals
+from activity import record_activity
+from archive import all_withdrawals
+from points_buffer import PointsBusy, points_buffer
+from ledger import record_balance_change
+from notifications import valid_email
+from tasks import generate_hard_task, generate_color_task
+
+# ======================
+# SERVICE LAYER
+# ======================
+# Shared by the HTML views, the JSON API and the Messenger worker. Functions
+# here never flash or redirect; rule violations raise ServiceError with the
+# message to show the user.
+
+TASK_COOLDOWN = 30
+CONVERT_POINTS = 200
+MIN_WITHDRAWAL = 300
+HISTORY_PAGE_SIZE = 20
+WITHDRAWAL_STATUSES = ("pending", "approved", "rejected")
+WITHDRAWAL_METHODS = ("GCash", "Maya", "Bank")
+
+# per task kind: generator, session key for the answer, session key for
+# the cooldown timestamp
+TASK_KINDS = {
+    "math": (generate_hard_task, "correct_answer", "last_task_time"),
+    "color": (generate_color_task, "color_correct", "last_color_task_time"),
+}
+
+class ServiceError(Exception):
+    def __init__(self, message, code="invalid"):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+# ======================
+# USERS
+# ======================
+def get_current_user():
+    uid = session.get("user")
+    if not isinstance(uid, int):
+        session.clear()
+        return None
+    return db.session.get(User, uid)
+
+def verify_recaptcha(token, remote_ip):
+    if not token:
+        raise ServiceError("Captcha missing.", "captcha")
+
+    r = requests.post(
+        "https://www.google.com/recaptcha/api/siteverify",
+        data={
+            "secret": os.environ.get("RECAPTCHA_SECRET_KEY"),
+            "response": token,
+            "remoteip": remote_ip
+        }
+    )
+    result = r.json()
+
+    if not result.get("success") or result.get("score", 0) < 0.3:
+        raise ServiceError("Suspicious activity detected.", "captcha")
+
+# Stored points plus task rewards still waiting in the points buffer
+def display_points(user):
+    return user.points + points_buffer.pending(user.id)
+
+def balance_summary(user):
+    return {
+        "user_id": user.user_id,
+        "points": display_points(user),
+        "cash": round(user.cash_balance or 0, 2),
+        "referrals": user.referrals,
+        "referral_cash": round(user.referral_balance or 0, 2)
+    }
+
+# ======================
+# TASKS
+# ======================
+def give_task_reward(user):
+    earned = random.randint(1, 2)
+    points_buffer.add(user.id, earned)
+    record_activity("task_completed", user.id, earned)
+    return earned
+
+def task_cooldown(kind, state):
+    _, _, time_key = TASK_KINDS[kind]
+    return max(0, TASK_COOLDOWN - (int(time.time()) - state.get(time_key, 0)))
+
+# Returns (question, remaining); question is None while cooling down
+def next_task(kind, state):
+    generate, answer_key, _ = TASK_KINDS[kind]
+
+    remaining = task_cooldown(kind, state)
+    if remaining > 0:
+        return None, remaining
+
+    question, answer = generate()
+    state[answer_key] = answer
+    return question, 0
+
+# Returns points earned, 0 for a wrong answer
+def answer_task(user, kind, answer, state):
+    _, answer_key, time_key = TASK_KINDS[kind]
+
+    if task_cooldown(kind, state) > 0:
+        raise ServiceError(
+            f"Please wait {TASK_COOLDOWN} seconds before next task",
+            "cooldown"
+        )
+
+    correct = state.get(answer_key)
+    answer = (answer or "").strip()
+
+    if kind == "math":
+        is_correct = answer.isdigit() and int(answer) == correct
+    else:
+        is_correct = answer.lower() == correct
+
+    earned = give_task_reward(user) if is_correct else 0
+
+    state[time_key] = int(time.time())
+    db.session.commit()
+    return earned
+
+# ======================
+# CASH
+# ======================
+def convert_points(user):
+    # write out buffered rewards, then re-read the row locked so neither a
+    # concurrent flush nor a second convert can interleave
+    try:
+        points_buffer.flush_user(user.id)
+    except PointsBusy:
+        raise ServiceError("Your points are still being saved, please try again.", "busy")
+    db.session.refresh(user, with_for_update=True)
+
+    if user.points < CONVERT_POINTS:
+        raise ServiceError(
+            f"You need at least {CONVERT_POINTS} points to convert.",
+            "insufficient_points"
+        )
+
+    # RANDOM PESO VALUE
+    peso = round(random.uniform(2.0, 2.5), 2)
+
+    user.points -= CONVERT_POINTS
+    user.cash_balance += peso
+    record_balance_change(user.user_id, peso, "conversion")
+    record_activity("conversion", user.id, peso)
+
+    db.session.commit()
+    return peso
+
+def request_withdrawal(user, amount, method, account, notify_email):
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise ServiceError("Invalid amount.")
+
+    # float() also accepts "nan" and "inf", which pass every comparison below
+    if not math.isfinite(amount):
+        raise ServiceError("Invalid amount.")
+
+    if method not in WITHDRAWAL_METHODS:
+        raise ServiceError("Choose GCash, Maya or Bank as the method.")
+
+    account = account.strip() if isinstance(account, str) else ""
+    if not account or len(account) > 100:
+        raise ServiceError("Enter the account name or number (up to 100 characters).")
+
+    notify_email = notify_email.strip() if isinstance(notify_email, str) else ""
+    if notify_email and not valid_email(notify_email):
+        raise ServiceError("Enter a valid email address for notifications.")
+
+    if amount < MIN_WITHDRAWAL:
+        raise ServiceError(f"Minimum withdrawal is ₱{MIN_WITHDRAWAL}.")
+
+    if amount > user.cash_balance:
+        raise ServiceError("Insufficient balance.", "insufficient_balance")
+
+    w = Withdrawal(
+        user_id=user.user_id,
+        amount=amount,
+        method=method,
+        account_info=account,
+        notify_email=notify_email or None
+    )
+
+    ensure_withdrawal_totals(user.user_id)
+
+    user.cash_balance -= amount
+    db.session.add(w)
+    db.session.flush()  # w.id for the ledger entry
+    record_balance_change(user.user_id, -amount, "withdrawal", w.id)
+    bump_withdrawal_totals(user.user_id, amount, None, "pending")
+    record_activity("withdrawal_requested", user.id, amount)
+    db.session.commit()
+    return w
+
+# ======================
+# WITHDRAWAL HISTORY
+# ======================
+# Users without a totals row yet (withdrawals made before the counters
+# existed) get one built from their history once; after that every status
+# change bumps the counters in place. Call this before the change.
+def ensure_withdrawal_totals(user_id):
+    if db.session.get(WithdrawalTotals, user_id):
+        return
+
+    history = all_withdrawals()
+    rows = db.session.execute(
+        db.select(
+            history.c.status,
+            db.func.count(),
+            db.func.coalesce(db.func.sum(history.c.amount), 0)
+        )
+        .where(history.c.user_id == user_id)
+        .group_by(history.c.status)
+    ).all()
+
+    totals = WithdrawalTotals(user_id=user_id)
+    for status in WITHDRAWAL_STATUSES:
+        setattr(totals, f"{status}_count", 0)
+        setattr(totals, f"{status}_amount", 0)
+    for status, count, amount in rows:
+        if status in WITHDRAWAL_STATUSES:
+            setattr(totals, f"{status}_count", count)
+            setattr(totals, f"{status}_amount", amount)
+
+    # A concurrent first call (say the page and the API at once) may have
+    # inserted the row meanwhile; then theirs stands and ours is dropped.
+    try:
+        with db.session.begin_nested():
+            db.session.add(totals)
+    except IntegrityError:
+        pass
+
+def bump_withdrawal_totals(user_id, amount, from_status, to_status):
+    # col = col + delta in SQL, so concurrent changes never lose an update
+    t = WithdrawalTotals
+    values = {}
+    if from_status:
+        values[f"{from_status}_count"] = getattr(t, f"{from_status}_count") - 1
+        values[f"{from_status}_amount"] = getattr(t, f"{from_status}_amount") - amount
+    if to_status:
+        values[f"{to_status}_count"] = getattr(t, f"{to_status}_count") + 1
+        values[f"{to_status}_amount"] = getattr(t, f"{to_status}_amount") + amount
+
+    db.session.execute(
+        db.update(t).where(t.user_id == user_id).values(**values),
+        execution_options={"synchronize_session": False}
+    )
+
+def withdrawal_totals(user):
+    ensure_withdrawal_totals(user.user_id)
+    db.session.commit()
+
+    totals = db.session.get(WithdrawalTotals, user.user_id)
+    return {
+        status: {
+            "count": getattr(totals, f"{status}_count"),
+            "amount": round(getattr(totals, f"{status}_amount") or 0, 2)
+        }
+        for status in WITHDRAWAL_STATUSES
+    }
+
+def encode_cursor(row):
+    return f"{row.requested_at.isoformat()}~{row.id}"
+
+def decode_cursor(cursor):
+    try:
+        ts, row_id = cursor.split("~")
+        return datetime.fromisoformat(ts), int(row_id)
+    except (AttributeError, ValueError):
+        raise ServiceError("Invalid page cursor.")
+
+def _history_time(column):
+    # SQLite stores server-default timestamps as "YYYY-MM-DD HH:MM:SS" text
+    # but binds datetimes with ".000000", so the raw column never equals a
+    # cursor and "<" matches the cursor row itself. Compare (and order) on
+    # one format there; Postgres compares real timestamps via the index.
+    if db.engine.dialect.name == "sqlite":
+        return db.func.strftime("%Y-%m-%d %H:%M:%f", column)
+    return column
+
+# Keyset pagination over hot + archived withdrawals, newest first. Returns
+# (rows, next_cursor); next_cursor is None on the last page.
+def withdrawal_history(user, status=None, before=None, limit=HISTORY_PAGE_SIZE):
+    history = all_withdrawals()
+    requested_at = _history_time(history.c.requested_at)
+    query = (
+        db.select(history)
+        .where(history.c.user_id == user.user_id)
+        .order_by(requested_at.desc(), history.c.id.desc())
+        .limit(limit + 1)
+    )
+
+    if status:
+        if status not in WITHDRAWAL_STATUSES:
+            raise ServiceError("Unknown status filter.")
+        query = query.where(history.c.status == status)
+
+    if before:
+        ts, row_id = decode_cursor(before)
+        ts = _history_time(db.literal(ts, db.DateTime))
+        query = query.where(db.or_(
+            requested_at < ts,
+            db.and_(requested_at == ts, history.c.id < row_id)
+        ))
+
+    rows = db.session.execute(query).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+
+    return rows, next_cursor
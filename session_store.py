@@ -0,0 +1,294 @@
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import delete, insert, select, update
+
+from models import db, SessionRecord
+
+try:
+    import redis
+except ImportError:  # only needed for SESSION_BACKEND=redis
+    redis = None
+
+# How often (at most) a process deletes expired sessions
+SWEEP_INTERVAL = 300
+
+serializer = TaggedJSONSerializer()
+
+SID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{20,64}$")
+
+# ======================
+# BACKENDS
+# ======================
+# Each backend stores serialized session data under an opaque id with a TTL.
+# load() returns (data, seconds_left) or None when missing or expired.
+
+class MemoryStore:
+    # Per-process, so only for development or a single worker.
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def load(self, sid):
+        with self.lock:
+            item = self.items.get(sid)
+        if not item:
+            return None
+
+        raw, expires = item
+        left = expires - time.monotonic()
+        if left <= 0:
+            return None
+        return serializer.loads(raw), left
+
+    def save(self, sid, data, ttl):
+        with self.lock:
+            self.items[sid] = (serializer.dumps(data), time.monotonic() + ttl)
+        self.maybe_sweep()
+
+    def touch(self, sid, ttl):
+        with self.lock:
+            item = self.items.get(sid)
+            if item:
+                self.items[sid] = (item[0], time.monotonic() + ttl)
+
+    def delete(self, sid):
+        with self.lock:
+            self.items.pop(sid, None)
+
+    def maybe_sweep(self):
+        now = time.monotonic()
+        if now - self.last_sweep < SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+
+        with self.lock:
+            for sid in [s for s, (_, exp) in self.items.items() if exp <= now]:
+                del self.items[sid]
+
+class DatabaseStore:
+    # Uses its own short connection on the primary so session writes never
+    # mix with the request's ORM transaction.
+    def __init__(self, app):
+        self.app = app
+        self.table = SessionRecord.__table__
+        self.last_sweep = time.monotonic()
+        self._engine = None
+
+    @property
+    def engine(self):
+        # sessions are also opened outside an app context (test clients)
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def load(self, sid):
+        t = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(t.c.data, t.c.expires_at).where(t.c.sid == sid)
+            ).first()
+
+        if not row:
+            return None
+
+        left = (row.expires_at - datetime.utcnow()).total_seconds()
+        if left <= 0:
+            return None
+        return serializer.loads(row.data), left
+
+    def save(self, sid, data, ttl):
+        t = self.table
+        values = {
+            "data": serializer.dumps(data),
+            "expires_at": datetime.utcnow() + timedelta(seconds=ttl)
+        }
+
+        with self.engine.begin() as conn:
+            result = conn.execute(update(t).where(t.c.sid == sid).values(**values))
+            if result.rowcount == 0:
+                conn.execute(insert(t).values(sid=sid, **values))
+
+        self.maybe_sweep()
+
+    def touch(self, sid, ttl):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(t)
+                .where(t.c.sid == sid)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+            )
+
+    def delete(self, sid):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.sid == sid))
+
+    def maybe_sweep(self):
+        now = time.monotonic()
+        if now - self.last_sweep < SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        self.sweep()
+
+    def sweep(self):
+        t = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(
+                delete(t).where(t.c.expires_at < datetime.utcnow())
+            ).rowcount
+
+class RedisStore:
+    # Works with Redis or anything speaking its protocol (Valkey, KeyDB...).
+    # Expiry is handled by the server's own TTLs.
+    def __init__(self, url, prefix="session:"):
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND=redis needs the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def load(self, sid):
+        key = self.prefix + sid
+        pipe = self.client.pipeline()
+        pipe.get(key)
+        pipe.ttl(key)
+        raw, left = pipe.execute()
+
+        if raw is None:
+            return None
+        return serializer.loads(raw), left
+
+    def save(self, sid, data, ttl):
+        self.client.set(self.prefix + sid, serializer.dumps(data), ex=int(ttl))
+
+    def touch(self, sid, ttl):
+        self.client.expire(self.prefix + sid, int(ttl))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+# ======================
+# SESSION OBJECT
+# ======================
+class ServerSession(SessionMixin):
+    # Nothing is fetched from the store until a key is actually read, so
+    # routes that never touch the session cost no lookup at all.
+    def __init__(self, store, sid=None):
+        self.store = store
+        self.sid = sid
+        self.old_sid = None
+        self.data = None
+        self.seconds_left = None
+        self.modified = False
+        self.accessed = False
+
+    def _load(self):
+        self.accessed = True
+        if self.data is None:
+            loaded = self.store.load(self.sid) if self.sid else None
+            if loaded is None:
+                self.data = {}
+                # unknown or expired id: never reuse it
+                self.sid = None
+            else:
+                self.data, self.seconds_left = loaded
+        return self.data
+
+    @property
+    def loaded(self):
+        return self.data is not None
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def clear(self):
+        # a cleared session (logout, login) gets a brand new id
+        self.accessed = True
+        if self.sid:
+            self.old_sid = self.sid
+            self.sid = None
+        self.data = {}
+        self.modified = True
+
+# ======================
+# FLASK INTERFACE
+# ======================
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and not SID_PATTERN.match(sid):
+            sid = None
+        return ServerSession(self.store, sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        ttl = app.permanent_session_lifetime.total_seconds()
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.old_sid:
+            self.store.delete(session.old_sid)
+
+        if not session.modified:
+            # keep active sessions alive without rewriting them every request
+            if session.loaded and session.sid and session.seconds_left is not None:
+                if session.seconds_left < ttl / 2:
+                    self.store.touch(session.sid, ttl)
+            return
+
+        if not session.data:
+            if session.sid:
+                self.store.delete(session.sid)
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.sid:
+            session.sid = secrets.token_urlsafe(32)
+
+        self.store.save(session.sid, session.data, ttl)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+def make_store(app, backend, redis_url=None):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "redis":
+        return RedisStore(redis_url or "redis://localhost:6379/0")
+    return DatabaseStore(app)
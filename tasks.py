@@ -0,0 +1,96 @@
+import random
+
+# ======================
+# TASK GENERATORS
+# ======================
+# Shared by the web routes and the Messenger worker.
+def generate_hard_task():
+    task_type = random.choice([
+        "counting",
+        "big_add",
+        "big_sub",
+        "multiply",
+        "divide",
+        "word",
+        "logic"
+    ])
+
+    # 1️⃣ COUNTING / CAPTCHA
+    if task_type == "counting":
+        a1 = random.randint(1, 9)
+        a2 = random.randint(1, 9)
+        question = (
+            f"There are {a1} apples, 2 bananas, "
+            f"and {a2} apples again. "
+            f"How many apples are there?"
+        )
+        answer = a1 + a2
+
+    # 2️⃣ BIG ADDITION
+    elif task_type == "big_add":
+        a = random.randint(10000, 999999)
+        b = random.randint(10000, 999999)
+        question = f"{a} + {b}"
+        answer = a + b
+
+    # 3️⃣ BIG SUBTRACTION
+    elif task_type == "big_sub":
+        a = random.randint(100000, 999999)
+        b = random.randint(10000, a)
+        question = f"{a} - {b}"
+        answer = a - b
+
+    # 4️⃣ MULTIPLICATION
+    elif task_type == "multiply":
+        a = random.randint(100, 999)
+        b = random.randint(10, 99)
+        question = f"{a} × {b}"
+        answer = a * b
+
+    # 5️⃣ DIVISION (CLEAN)
+    elif task_type == "divide":
+        b = random.randint(2, 20)
+        answer = random.randint(10, 500)
+        a = b * answer
+        question = f"{a} ÷ {b}"
+
+    # 6️⃣ WORD PROBLEM
+    elif task_type == "word":
+        box = random.randint(5, 20)
+        per_box = random.randint(50, 200)
+        question = (
+            f"A warehouse has {box} boxes. "
+            f"Each box contains {per_box} items. "
+            f"How many items are there in total?"
+        )
+        answer = box * per_box
+
+    # 7️⃣ LOGIC CAPTCHA
+    else:
+        nums = random.sample(range(1, 30), 6)
+        question = (
+            f"Count the even numbers only: "
+            f"{', '.join(map(str, nums))}"
+        )
+        answer = len([n for n in nums if n % 2 == 0])
+
+    return question, answer
+
+def generate_color_task():
+    colors = [
+        "red", "blue", "green", "yellow", "orange",
+        "purple", "pink", "brown", "black", "white",
+        "gray", "cyan", "magenta", "lime", "teal"
+    ]
+
+    sequence = random.sample(colors, 6)
+    index = random.randint(1, 6)
+
+    question = (
+        f"Memorize the colors:\n"
+        f"{', '.join(sequence)}\n\n"
+        f"What is the {index}th color?"
+    )
+
+    answer = sequence[index - 1]
+    return question, answer
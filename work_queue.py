@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from models import db
+
+# ======================
+# CLAIMING QUEUE ROWS
+# ======================
+# Shared by the notification outbox and the Messenger event queue. FOR
+# UPDATE SKIP LOCKED lets several workers run side by side without picking
+# the same rows; the claim is committed straight away so no row locks are
+# held while the batch is worked on. Rows left in `busy_status` longer than
+# `timeout` seconds (the worker died) are claimed again.
+def claim_rows(model, ready, busy_status, timeout, limit):
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=timeout)
+
+    rows = (
+        model.query
+        .filter(
+            db.or_(
+                ready,
+                db.and_(model.status == busy_status, model.claimed_at < stale)
+            )
+        )
+        .order_by(model.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    for row in rows:
+        row.status = busy_status
+        row.claimed_at = now
+
+    ids = [row.id for row in rows]
+    db.session.commit()
+
+    # reload the expired rows in one query rather than one per attribute access
+    return model.query.filter(model.id.in_(ids)).order_by(model.id).all()